@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+import asyncio
+import json
+import random
+import requests
+import threading
+import time
+import tomllib
+from atomic import write_atomic
+from email.utils import parsedate_to_datetime
+from pathlib import Path
+from urllib.parse import urljoin
+
+
+class Client:
+    API_URL = 'https://api.icfpcontest.com'
+    CDN_URL = 'https://cdn.icfpcontest.com/problems/'
+    RETRY_STATUS = {429, 500, 502, 503, 504}
+    # a POST may have been handled before the failure, only retry when it was refused
+    RETRY_STATUS_POST = {429, 503}
+
+    def __init__(self, headers, api_url=None, cdn_url=None, pool_size=10, tries=10, backoff=0.5, max_delay=30, rate=None):
+        self.api_url = api_url or self.API_URL
+        self.cdn_url = cdn_url or self.CDN_URL
+        self.headers = headers or dict()
+        self.backend = None
+        self.timeout = (0.3, 10)
+        self.pool_size = pool_size
+        self.tries = tries
+        self.backoff = backoff
+        self.max_delay = max_delay
+        self.rate = rate
+        self.lock = threading.Lock()
+        self.next_request = 0
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def open(self):
+        if self.backend is None:
+            self.backend = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+            self.backend.mount('http://', adapter)
+            self.backend.mount('https://', adapter)
+        return self
+
+    def close(self):
+        if (ses := self.backend) is not None:
+            self.backend = None
+            ses.close()
+
+    def throttle(self):
+        # spaces requests by 1/rate seconds
+        with self.lock:
+            now = time.monotonic()
+            at = max(now, self.next_request)
+            self.next_request = at + (1 / self.rate if self.rate else 0)
+        if at > now:
+            time.sleep(at - now)
+
+    def hold(self, delay):
+        # the server asked to slow down, so every caller waits
+        with self.lock:
+            self.next_request = max(self.next_request, time.monotonic() + delay)
+
+    def retry_after(self, r):
+        if (s := r.headers.get('Retry-After')) is None:
+            return None
+        try:
+            return max(0, float(s))
+        except ValueError:
+            pass
+        try:
+            return max(0, parsedate_to_datetime(s).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+    def request(self, method, url, **kwargs):
+        idempotent = method in ('GET', 'HEAD')
+        retry_status = self.RETRY_STATUS if idempotent else self.RETRY_STATUS_POST
+        retry_errors = (requests.ConnectionError, requests.Timeout) if idempotent else requests.ConnectTimeout
+        for attempt in range(self.tries):
+            self.throttle()
+            last = attempt + 1 == self.tries
+            try:
+                r = self.backend.request(method, url, timeout=self.timeout, **kwargs)
+            except retry_errors:
+                if last:
+                    raise
+                r = None
+            if r is not None and (last or r.status_code not in retry_status):
+                return r
+            delay = random.uniform(0, min(self.max_delay, self.backoff * 2 ** attempt))
+            ra = self.retry_after(r) if r is not None else None
+            if ra is not None or (r is not None and r.status_code == 429):
+                self.hold(max(delay, ra or 0))
+            else:
+                # transient failures only back off this caller
+                time.sleep(delay)
+
+    def get_bytes(self, path):
+        url = urljoin(self.api_url, path)
+        r = self.request('GET', url, headers=self.headers)
+        r.raise_for_status()
+        return r.content
+
+    def get_json(self, path):
+        url = urljoin(self.api_url, path)
+        r = self.request('GET', url, headers=self.headers)
+        r.raise_for_status()
+        return r.json()
+
+    def post_json(self, path, body):
+        url = urljoin(self.api_url, path)
+        r = self.request('POST', url, json=body, headers=self.headers)
+        r.raise_for_status()
+        return r.json()
+
+    def get_submission(self, sid):
+        r = self.get_json(f'/submission?submission_id={sid}')
+        return r['Success']['submission']
+
+    def post_submission(self, pid, ans):
+        body = {'problem_id':pid, 'contents': json.dumps(ans)}
+        r = self.post_json('/submission', body)
+        return r
+
+    def get_problems_count(self):
+        r = self.get_json('/problems')
+        return r['number_of_problems']
+
+    def get_problem(self, pid):
+        r = self.get_json(f'/problem?problem_id={pid}')
+        s = r['Success']
+        return json.loads(s)
+
+    def cdn_headers(self):
+        headers = self.headers.copy()
+        headers.pop('Authorization', None)
+        return headers
+
+    def cdn_problem(self, pid):
+        url = urljoin(self.cdn_url, f'{pid}.json')
+        r = self.request('GET', url, headers=self.cdn_headers())
+        r.raise_for_status()
+        return r.content
+
+    def cdn_download(self, pid, fn, validators=None):
+        url = urljoin(self.cdn_url, f'{pid}.json')
+        headers = self.cdn_headers()
+        if validators:
+            if (etag := validators.get('etag')):
+                headers['If-None-Match'] = etag
+            if (mtime := validators.get('last_modified')):
+                headers['If-Modified-Since'] = mtime
+        with self.request('GET', url, headers=headers, stream=True) as r:
+            if r.status_code == 304:
+                return None
+            r.raise_for_status()
+            write_atomic(fn, r.iter_content(chunk_size=1 << 16))
+            return {'etag': r.headers.get('ETag'), 'last_modified': r.headers.get('Last-Modified')}
+
+
+class AsyncClient:
+    # runs the blocking client calls on worker threads, sharing one session
+    def __init__(self, client, concurrency=None):
+        self.client = client
+        self.limit = asyncio.Semaphore(concurrency or client.pool_size)
+
+    async def __aenter__(self):
+        self.client.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.client.close()
+
+    async def call(self, fn, *args):
+        async with self.limit:
+            return await asyncio.to_thread(fn, *args)
+
+    async def get_submission(self, sid):
+        return await self.call(self.client.get_submission, sid)
+
+    async def post_submission(self, pid, ans):
+        return await self.call(self.client.post_submission, pid, ans)
+
+    async def get_json(self, path):
+        return await self.call(self.client.get_json, path)
+
+    async def post_json(self, path, body):
+        return await self.call(self.client.post_json, path, body)
+
+
+def load_headers():
+    proj = Path(__file__).parent.parent
+    env = proj / '.env'
+    headers = None
+    if env.is_file():
+        with env.open('rb') as fp:
+            config = tomllib.load(fp)
+            headers = config.get('headers', dict())
+    return headers
+
+
+def open_client(**kwargs):
+    return Client(headers=load_headers(), **kwargs)
+
+
+def open_async_client(concurrency=None, **kwargs):
+    return AsyncClient(open_client(**kwargs), concurrency)
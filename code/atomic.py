@@ -0,0 +1,29 @@
+#!/usr/bin/env python
+import os
+import tempfile
+from pathlib import Path
+
+
+# temporary files are created 0600, give the result what open() would
+UMASK = os.umask(0)
+os.umask(UMASK)
+
+
+def write_atomic(fn, data):
+    # data is text, bytes or an iterable of byte chunks. Readers see the old
+    # file or the new one, never a partial write.
+    fn = Path(fn)
+    fn.parent.mkdir(parents=True, exist_ok=True)
+    mode = 'w' if isinstance(data, str) else 'wb'
+    with tempfile.NamedTemporaryFile(mode, dir=fn.parent, prefix=fn.name, delete=False) as fp:
+        try:
+            if isinstance(data, (str, bytes)):
+                fp.write(data)
+            else:
+                for chunk in data:
+                    fp.write(chunk)
+            os.fchmod(fp.fileno(), 0o666 & ~UMASK)
+        except BaseException:
+            Path(fp.name).unlink(missing_ok=True)
+            raise
+    Path(fp.name).replace(fn)
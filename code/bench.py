@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+import hashlib
+import json
+import re
+import sys
+import time
+import tracemalloc
+import numpy as np
+import score
+from atomic import write_atomic
+from occlusion import Occlusion
+from pathlib import Path
+
+
+def bench_solution(problem):
+    # deterministic grid placement, 20 apart where the stage allows it
+    sw = problem['stage_width']
+    sh = problem['stage_height']
+    ox,oy = problem['stage_bottom_left']
+    n = len(problem['musicians'])
+    for step in (20, 10):
+        xs = np.arange(ox + 10, ox + sw - 10 + 1e-9, step)
+        ys = np.arange(oy + 10, oy + sh - 10 + 1e-9, step)
+        if len(xs) * len(ys) >= n:
+            break
+    pos = [(float(x), float(y)) for y in ys for x in xs][:n]
+    return {
+        'placements': [{'x':x, 'y':y} for x,y in pos],
+        'volumes': [1 + j % 10 for j in range(n)],
+    }
+
+
+def solution_key(solution):
+    return hashlib.sha256(json.dumps(solution, sort_keys=True).encode()).hexdigest()[:16]
+
+
+class Phases:
+    def __init__(self):
+        self.times = dict()
+        self.last = time.perf_counter()
+
+    def mark(self, name):
+        now = time.perf_counter()
+        self.times[name] = self.times.get(name, 0) + now - self.last
+        self.last = now
+
+
+def run_np(fn, solution, scoring_mode):
+    ph = Phases()
+    with Path(fn).open() as fp:
+        problem = json.load(fp)
+    columns = score.problem_columns(problem)
+    musicians, people, tastes, pillars = (columns[k] for k in ('musicians', 'people', 'tastes', 'pillars'))
+    occ = Occlusion(people, pillars, columns['stage'].tolist())
+    pos, volumes = score.solution_arrays(solution)
+    ph.mark('load')
+    vis = occ.visibility(pos)
+    ph.mark('occlusion')
+    sub, qm = score.sum_musicians_np(vis, pos, musicians, people, tastes, scoring_mode)
+    ans = score.total_score(sub, qm, volumes, scoring_mode)
+    ph.mark('summation')
+    return ans, ph.times
+
+
+def run_py(fn, solution, scoring_mode, cull=False):
+    ph = Phases()
+    with Path(fn).open() as fp:
+        problem = json.load(fp)
+    ph.mark('load')
+    ans = score.score_reference(problem, solution, scoring_mode, cull)
+    ph.mark('summation')
+    return ans, ph.times
+
+
+ENGINES = {
+    'np': run_np,
+    'py': run_py,
+    'py-cull': lambda fn, solution, scoring_mode: run_py(fn, solution, scoring_mode, cull=True),
+}
+
+
+def measure(engine, fn, solution, scoring_mode):
+    # tracing slows the py engines by an order of magnitude, so times come
+    # from a plain run and the peak from a second, traced one
+    t = time.perf_counter()
+    ans, phases = ENGINES[engine](fn, solution, scoring_mode)
+    wall = time.perf_counter() - t
+    tracemalloc.start()
+    try:
+        ENGINES[engine](fn, solution, scoring_mode)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {'score': ans, 'wall': wall, 'phases': phases, 'peak': peak}
+
+
+def load_references(fn):
+    if fn.is_file():
+        with fn.open() as fp:
+            return json.load(fp)
+    return dict()
+
+
+def problem_files(dirs, pids):
+    files = list()
+    for d in dirs:
+        for fn in Path(d).glob('problem-*.json'):
+            pid, = map(int, re.findall(r'(\d+)\.json', fn.name))
+            if not pids or pid in pids:
+                files.append((pid, fn))
+    return sorted(files)
+
+
+def main(dirs, engines, solutions, references, compute_reference, pids, output):
+    freference = Path(references)
+    refs = load_references(freference)
+    results = list()
+    failed = 0
+    print(f'{"pid":>4} {"engine":>6} {"score":>14} {"wall":>8} {"load":>8} {"occl":>8} {"sum":>8} {"peak MB":>8}  status')
+    for pid,fn in problem_files(dirs, pids):
+        scoring_mode = score.problem_scoring_mode(fn)
+        fsol = Path(solutions) / f'solution-{pid}.json' if solutions else None
+        with fn.open() as fp:
+            problem = json.load(fp)
+        if fsol and fsol.is_file():
+            solution = score.load_solution(fsol)
+        else:
+            solution = bench_solution(problem)
+        key = f'{pid}:{solution_key(solution)}'
+
+        if key not in refs and compute_reference:
+            refs[key] = score.score_reference(problem, solution, scoring_mode)
+            write_atomic(freference, json.dumps(refs, indent=1, sort_keys=True))
+        expect = refs.get(key)
+
+        for engine in engines:
+            res = measure(engine, fn, solution, scoring_mode)
+            if expect is None:
+                status = 'no reference'
+            elif res['score'] == expect:
+                status = 'ok'
+            else:
+                status = f'DIVERGED, expected {expect}'
+                failed += 1
+            ph = res['phases']
+            print(f'{pid:>4} {engine:>6} {res["score"]:>14} {res["wall"]:>8.3f}',
+                *(f'{ph.get(k, 0):>8.3f}' for k in ('load', 'occlusion', 'summation')),
+                f'{res["peak"] / 2**20:>8.1f}  {status}', flush=True)
+            results.append({'pid': pid, 'engine': engine, 'reference': expect, 'status': status, **res})
+
+    if output:
+        with Path(output).open('w') as fp:
+            json.dump(results, fp, indent=1)
+    if failed:
+        print(f'! {failed} results diverged from the reference', file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    proj = Path(__file__).parent.parent
+    taskdirs = [proj / 'task' / 'lite', proj / 'task' / 'full']
+    reffile = proj / 'cache' / 'bench-reference.json'
+
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-d', '--problems-directory', action='append', help='problems directory, default task/lite and task/full')
+    parser.add_argument('-e', '--engine', action='append', choices=sorted(ENGINES), help='engine to benchmark, default np')
+    parser.add_argument('-s', '--solutions-directory', help='take solutions from here, default generated grid placements')
+    parser.add_argument('-r', '--references', default=reffile, help='reference scores file, default ' + str(reffile))
+    parser.add_argument('--compute-reference', action='store_true', help='score missing references with the py engine, slow')
+    parser.add_argument('-p', '--pid', action='append', type=int, help='limit to problem id')
+    parser.add_argument('-o', '--output', help='write results as json')
+    args = parser.parse_args()
+    main(
+        dirs=args.problems_directory or taskdirs,
+        engines=args.engine or ['np'],
+        solutions=args.solutions_directory,
+        references=args.references,
+        compute_reference=args.compute_reference,
+        pids=set(args.pid or []),
+        output=args.output
+    )
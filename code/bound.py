@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+import hashlib
+import json
+import math
+import re
+import numpy as np
+from atomic import write_atomic
+from occlusion import stage_distance2
+from pathlib import Path
+from preprocess import load_columns
+from score import problem_scoring_mode
+from validate import SPACING, MAX_VOLUME
+
+
+def upper_bound(columns, scoring_mode):
+    # every musician unoccluded at the stage point nearest to each attendee,
+    # seen only by attendees who like the instrument, at full volume
+    d2 = np.maximum(stage_distance2(columns['people'], columns['stage'].tolist()), 1e-9)
+    tastes = np.maximum(columns['tastes'], 0)
+    best = np.ceil(1000000 * tastes / d2[:,None]).astype(np.int64).sum(axis=0)
+    ks, counts = np.unique(columns['musicians'], return_counts=True)
+    ans = 0
+    for k,n in zip(ks.tolist(), counts.tolist()):
+        if scoring_mode == 2:
+            # same instrument neighbours are at least SPACING apart
+            ans += n * math.ceil(int(best[k]) * (1 + (n - 1) / SPACING) * MAX_VOLUME)
+        else:
+            ans += n * int(best[k]) * MAX_VOLUME
+    return ans
+
+
+def load_bounds(fn):
+    if fn.is_file():
+        with fn.open() as fp:
+            return json.load(fp)
+    return dict()
+
+
+def problem_bound(fn, scoring_mode, cache=None):
+    if cache is None:
+        cache = Path(__file__).parent.parent / 'cache' / 'bounds.json'
+    fn = Path(fn)
+    key = f'{fn.stem}-{hashlib.sha256(fn.read_bytes()).hexdigest()[:16]}-m{scoring_mode}'
+    bounds = load_bounds(cache)
+    if key not in bounds:
+        bounds[key] = upper_bound(load_columns(fn), scoring_mode)
+        write_atomic(cache, json.dumps(bounds, indent=1, sort_keys=True))
+    return bounds[key]
+
+
+def main(inputs, solutions):
+    for fn in inputs:
+        pid, = map(int, re.findall(r'(\d+)\.json', str(fn)))
+        bound = problem_bound(fn, problem_scoring_mode(fn, pid))
+        fscore = Path(solutions) / f'solution-{pid}.score.txt'
+        current = float(fscore.read_text()) if fscore.is_file() else 0
+        print(f'{pid:>4} {bound:>16} {int(bound - current):>16}')
+
+
+if __name__ == '__main__':
+    proj = Path(__file__).parent.parent
+    solvdir = proj / 'solves'
+
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('inputs', nargs='+', help='problem files')
+    parser.add_argument('-s', '--solutions-directory', default=solvdir, help='solutions directory, default ' + str(solvdir))
+    args = parser.parse_args()
+    main(
+        inputs=args.inputs,
+        solutions=args.solutions_directory
+    )
@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+import numpy as np
+import profiling
+from validate import stage_region
+
+
+def stage_distance2(people, stage):
+    # squared distance from each attendee to the nearest place a musician may stand
+    x0, y0, x1, y1 = stage_region(stage)
+    zero = np.zeros(len(people))
+    dx = np.maximum.reduce([x0 - people[:,0], zero, people[:,0] - x1])
+    dy = np.maximum.reduce([y0 - people[:,1], zero, people[:,1] - y1])
+    return dx * dx + dy * dy
+
+
+def pillar_index(people, pillars, stage, eps=1e-6):
+    # CSR lists of the pillars that can stand between each attendee and a
+    # musician somewhere on the stage: closer than the farthest stage corner,
+    # and with an angular interval, modulo pi, that meets the stage's wedge
+    people = np.asarray(people, dtype=np.float64).reshape(-1, 2)
+    pillars = np.asarray(pillars, dtype=np.float64).reshape(-1, 3)
+    x0, y0, x1, y1 = stage_region(stage)
+    qx, qy = people[:,0,None], people[:,1,None]
+    cx = np.array([x0, x1, x0, x1]) - qx
+    cy = np.array([y0, y0, y1, y1]) - qy
+    mid = np.arctan2((y0 + y1) / 2 - qy, (x0 + x1) / 2 - qx)
+    off = np.mod(np.arctan2(cy, cx) - mid + np.pi, 2 * np.pi) - np.pi
+    lo, hi = off.min(axis=1, keepdims=True), off.max(axis=1, keepdims=True)
+    mid = mid + (lo + hi) / 2
+    half = (hi - lo) / 2
+    inside = (x0 <= qx) & (qx <= x1) & (y0 <= qy) & (qy <= y1)
+    far2 = (cx * cx + cy * cy).max(axis=1, keepdims=True)
+
+    pzx = pillars[:,0] - qx
+    pzy = pillars[:,1] - qy
+    pz2 = pzx * pzx + pzy * pzy
+    with np.errstate(divide='ignore', invalid='ignore'):
+        width = np.arcsin(np.fmin(np.sqrt(pillars[:,2] * pillars[:,2] / pz2), 1))
+    delta = np.mod(np.arctan2(pzy, pzx) - mid + np.pi / 2, np.pi) - np.pi / 2
+    keep = (np.abs(delta) <= half + width + eps) | (half + width + eps >= np.pi / 2) | inside
+    keep &= pz2 < far2 * (1 + eps) + eps
+    indptr = np.zeros(len(people) + 1, dtype=np.int64)
+    np.cumsum(keep.sum(axis=1), out=indptr[1:])
+    return indptr, np.nonzero(keep)[1]
+
+
+class Occlusion:
+    # Angular sweep: as seen from an attendee, a blocker at distance t with
+    # radius r can only hide targets whose line of sight is within
+    # asin(r / t) of the blocker direction. Angles are taken modulo pi since
+    # the blocking test is symmetric about the attendee. Candidates found by
+    # the sweep are confirmed with the exact test from score.score_placement.
+    # Given the stage, each attendee only keeps the pillars from pillar_index,
+    # padded to the longest list with pillars of radius 0 that never block.
+    # That is only exact for musicians on the stage region, so the first
+    # position outside it switches back to all pillars.
+
+    MUSICIAN_RADIUS = 5
+    EPS = 1e-9
+    ROWS_PER_CHUNK = 1 << 18
+    PAIRS_PER_CHUNK = 1 << 20
+
+    def __init__(self, people, pillars, stage=None):
+        self.people = np.asarray(people, dtype=np.float64).reshape(-1, 2)
+        self.pillars = np.asarray(pillars, dtype=np.float64).reshape(-1, 3)
+        self.region = None if stage is None else stage_region(stage)
+        index = None if stage is None else pillar_index(self.people, self.pillars, stage)
+        self._pillar_columns(index)
+
+    def _pillar_columns(self, index):
+        pillars = self.pillars
+        qx, qy = self.people[:,0,None], self.people[:,1,None]
+        if index is None:
+            self.pzx = qx - pillars[:,0]
+            self.pzy = qy - pillars[:,1]
+            self.pz2 = self.pzx * self.pzx + self.pzy * self.pzy
+            self.prr = np.broadcast_to(pillars[:,2] * pillars[:,2], self.pz2.shape)
+            self.pangle, self.pwidth = self._sweep(self.pzx, self.pzy, self.pz2, self.prr)
+            return
+        indptr, indices = index
+        n = np.diff(indptr)
+        pad = np.arange(n.max(initial=0)) < n[:,None]
+        cols = np.zeros(pad.shape, dtype=np.int64)
+        cols[pad] = indices
+        self.pzx = np.where(pad, qx - pillars[cols,0], 0)
+        self.pzy = np.where(pad, qy - pillars[cols,1], 0)
+        self.pz2 = np.where(pad, self.pzx * self.pzx + self.pzy * self.pzy, np.inf)
+        self.prr = np.where(pad, pillars[cols,2] * pillars[cols,2], 0)
+        self.pangle, self.pwidth = self._sweep(self.pzx, self.pzy, self.pz2, self.prr)
+        self.pwidth[~pad] = -np.inf
+
+    def _cover(self, positions):
+        if self.region is None:
+            return
+        x0,y0,x1,y1 = self.region
+        x, y = positions[...,0], positions[...,1]
+        if not ((x0 <= x) & (x <= x1) & (y0 <= y) & (y <= y1)).all():
+            self.region = None
+            self._pillar_columns(None)
+
+    def _sweep(self, tzx, tzy, tz2, rr):
+        angle = np.mod(np.arctan2(tzy, tzx), np.pi)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            s = np.sqrt(rr / tz2)
+        width = np.arcsin(np.fmin(s, 1)) + self.EPS
+        return angle, np.minimum(width, np.pi / 2)
+
+    def _blockers(self, placement, rows):
+        qx, qy = self.people[rows,0,None], self.people[rows,1,None]
+        tzx = qx - placement[:,0]
+        tzy = qy - placement[:,1]
+        tz2 = tzx * tzx + tzy * tzy
+        rr = np.full(tz2.shape, float(self.MUSICIAN_RADIUS * self.MUSICIAN_RADIUS))
+        angle, width = self._sweep(tzx, tzy, tz2, rr)
+        return tzx, tzy, tz2, rr, angle, width
+
+    def counts(self, placement):
+        placement = np.asarray(placement, dtype=np.float64).reshape(-1, 2)
+        self._cover(placement)
+        na, nm, npl = len(self.people), len(placement), len(self.pillars)
+        res = np.zeros((na, nm), dtype=np.int32)
+        if nm == 0:
+            return res
+        step = max(1, self.ROWS_PER_CHUNK // (nm + npl + 1))
+        for a0 in range(0, na, step):
+            rows = slice(a0, min(na, a0 + step))
+            res[rows] = self._counts(placement, rows)
+        return res
+
+    def _counts(self, placement, rows):
+        nm = len(placement)
+        tzx, tzy, tz2, rr, angle, width = self._blockers(placement, rows)
+        nr = len(tz2)
+        # targets, with copies shifted by -pi and +pi to handle wrap around
+        tang = np.hstack([angle - np.pi, angle, angle + np.pi])
+        order = np.argsort(tang, axis=1, kind='stable')
+        shift = 4 * np.pi * np.arange(nr)[:,None]
+        keys = (np.take_along_axis(tang, order, axis=1) + shift).ravel()
+        order = (order % nm + nm * np.arange(nr)[:,None]).ravel()
+
+        # blockers are musicians followed by pillars
+        bzx = np.hstack([tzx, self.pzx[rows]])
+        bzy = np.hstack([tzy, self.pzy[rows]])
+        bz2 = np.hstack([tz2, self.pz2[rows]])
+        brr = np.hstack([rr, self.prr[rows]])
+        bang = np.hstack([angle, self.pangle[rows]]) + shift
+        bwid = np.hstack([width, self.pwidth[rows]])
+        lo = np.searchsorted(keys, (bang - bwid).ravel(), side='left')
+        hi = np.searchsorted(keys, (bang + bwid).ravel(), side='left')
+        n = np.maximum(hi - lo, 0)
+        res = np.zeros(nr * nm, dtype=np.int32)
+        nb = bz2.shape[1]
+        bzx, bzy, bz2, brr = bzx.ravel(), bzy.ravel(), bz2.ravel(), brr.ravel()
+        people = self.people[rows]
+        # expand (blocker, target) candidates in batches of about PAIRS_PER_CHUNK
+        ends = np.cumsum(n)
+        cuts = np.searchsorted(ends, np.arange(self.PAIRS_PER_CHUNK, ends[-1] if len(ends) else 0, self.PAIRS_PER_CHUNK))
+        for b0,b1 in zip([0, *(cuts + 1)], [*(cuts + 1), len(n)]):
+            bn = n[b0:b1]
+            total = int(bn.sum())
+            if total == 0:
+                continue
+            pb = np.repeat(np.arange(b0, b1), bn)
+            pt = order[np.repeat(lo[b0:b1] - np.cumsum(bn) + bn, bn) + np.arange(total)]
+            row = pb // nb
+            t = pt % nm
+            dx = placement[t,0] - people[row,0]
+            dy = placement[t,1] - people[row,1]
+            d2 = dx * dx + dy * dy
+            f = dx * bzy[pb] - bzx[pb] * dy
+            hit = (f * f < brr[pb] * d2) & (bz2[pb] < d2) & (pb % nb != t)
+            res += np.bincount(pt[hit], minlength=nr * nm).astype(np.int32)
+            if profiling.PROFILE is not None:
+                pillar_tests = int(np.count_nonzero(pb % nb >= nm))
+                profiling.count('segment_tests', total - pillar_tests)
+                profiling.count('pillar_tests', pillar_tests)
+                profiling.count('blocked', int(np.count_nonzero(hit)))
+        if profiling.PROFILE is not None:
+            # against the brute force, which tests every blocker for every pair
+            profiling.count('pruned_tests', nr * nm * (nb - 1) - int(n.sum()))
+        return res.reshape(nr, nm)
+
+    def visibility(self, placement):
+        return self.counts(placement) == 0
+
+    def target_counts(self, placement, j, pos=None):
+        # blockers of musician j, optionally placed at pos, for every attendee
+        placement = np.asarray(placement, dtype=np.float64).reshape(-1, 2)
+        self._cover(placement)
+        if pos is not None:
+            self._cover(np.asarray(pos, dtype=np.float64))
+        px, py = placement[j] if pos is None else pos
+        qx, qy = self.people[:,0], self.people[:,1]
+        dx = (px - qx)[:,None]
+        dy = (py - qy)[:,None]
+        d2 = dx * dx + dy * dy
+        tzx = qx[:,None] - placement[:,0]
+        tzy = qy[:,None] - placement[:,1]
+        f = dx * tzy - tzx * dy
+        hit = (f * f < 25 * d2) & (tzx * tzx + tzy * tzy < d2)
+        hit[:,j] = False
+        f = dx * self.pzy - self.pzx * dy
+        phit = (f * f < self.prr * d2) & (self.pz2 < d2)
+        return (hit.sum(axis=1) + phit.sum(axis=1)).astype(np.int32)
+
+    def blocker_hits(self, placement, j, *positions):
+        # pairs blocked by musician j, at its own place or at each of positions
+        placement = np.asarray(placement, dtype=np.float64).reshape(-1, 2)
+        qx, qy = self.people[:,0,None], self.people[:,1,None]
+        dx = placement[:,0] - qx
+        dy = placement[:,1] - qy
+        d2 = dx * dx + dy * dy
+        res = list()
+        for bx,by in positions or [placement[j]]:
+            tzx = qx - bx
+            tzy = qy - by
+            f = dx * tzy - tzx * dy
+            hit = (f * f < 25 * d2) & (tzx * tzx + tzy * tzy < d2)
+            hit[:,j] = False
+            res.append(hit)
+        return res if positions else res[0]
+
+    def visible(self, placement, i, j):
+        placement = np.asarray(placement, dtype=np.float64).reshape(-1, 2)
+        self._cover(placement)
+        qx, qy = self.people[i]
+        dx = placement[j,0] - qx
+        dy = placement[j,1] - qy
+        d2 = dx * dx + dy * dy
+        tzx = qx - placement[:,0]
+        tzy = qy - placement[:,1]
+        f = dx * tzy - tzx * dy
+        hit = (f * f < 25 * d2) & (tzx * tzx + tzy * tzy < d2)
+        hit[j] = False
+        if hit.any():
+            return False
+        f = dx * self.pzy[i] - self.pzx[i] * dy
+        return not ((f * f < self.prr[i] * d2) & (self.pz2[i] < d2)).any()
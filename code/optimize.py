@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+import json
+import random
+import re
+import time
+import numpy as np
+import score
+from atomic import write_atomic
+from pathlib import Path
+from validate import SPACING, stage_region
+
+
+class Deadline:
+    def __init__(self, time_limit):
+        self.at = time.monotonic() + time_limit if time_limit else None
+
+    def __bool__(self):
+        return self.at is not None and time.monotonic() >= self.at
+
+
+def is_free(placement, j, pos, bounds):
+    x0,y0,x1,y1 = bounds
+    if not (x0 <= pos[0] <= x1 and y0 <= pos[1] <= y1):
+        return False
+    d = placement - pos
+    d2 = (d * d).sum(axis=1)
+    d2[j] = np.inf
+    return bool(d2.min(initial=np.inf) >= SPACING * SPACING)
+
+
+def volume_pass(sc):
+    # each value is linear in its volume, so only 0 or 10 can be best
+    gain = 0
+    for j in range(len(sc.volumes)):
+        best = max((0, 10), key=lambda v: sc.delta_volume(j, v))
+        if (d := sc.delta_volume(j, best)) > 0:
+            sc.set_volume(j, best)
+            gain += d
+    return gain
+
+
+def swap_pass(sc, rng, deadline):
+    gain = 0
+    nm = len(sc.musicians)
+    if len(set(sc.musicians.tolist())) < 2:
+        return gain
+    for _ in range(nm):
+        if deadline:
+            break
+        j,m = rng.sample(range(nm), 2)
+        if sc.musicians[j] == sc.musicians[m]:
+            continue
+        if (d := sc.delta_swap(j, m)) > 0:
+            sc.swap(j, m)
+            gain += d
+    return gain
+
+
+def nudge_pass(sc, rng, bounds, step, deadline):
+    gain = 0
+    order = list(range(len(sc.musicians)))
+    rng.shuffle(order)
+    for j in order:
+        if deadline:
+            break
+        a = rng.uniform(0, 2 * np.pi)
+        pos = sc.placement[j] + step * np.array([np.cos(a), np.sin(a)])
+        if not is_free(sc.placement, j, pos, bounds):
+            continue
+        if (d := sc.delta_move(j, pos)) > 0:
+            sc.move(j, pos)
+            gain += d
+    return gain
+
+
+def optimize(problem, solution, scoring_mode, time_limit=None, seed=None, max_step=8, min_step=0.5):
+    # time_limit in seconds, without one it runs until a round at min_step gains nothing
+    deadline = Deadline(time_limit)
+    rng = random.Random(seed)
+    p = score.Problem(problem, scoring_mode)
+    bounds = stage_region(p.stage.tolist())
+    sc = p.scorer(solution)
+    start = sc.score
+    step = max_step
+    while not deadline:
+        gain = volume_pass(sc)
+        gain += swap_pass(sc, rng, deadline)
+        gain += nudge_pass(sc, rng, bounds, step, deadline)
+        print(f'round: step {step:g}, score {sc.score} ({gain:+d})', flush=True)
+        if gain <= 0:
+            if step <= min_step:
+                break
+            step = max(min_step, step / 2)
+    volume_pass(sc)
+    return start, sc.score, sc.solution()
+
+
+def main(input, pid, solution, output, time_limit, seed):
+    if pid is None:
+        pid, = map(int, re.findall(r'(\d+)\.json', input))
+    scoring_mode = score.problem_scoring_mode(input, pid)
+
+    proj = Path(__file__).parent.parent
+    fsol = Path(solution) if solution else proj / 'solves' / f'solution-{pid}.json'
+    fout = Path(output) if output else fsol
+
+    with Path(input).open() as fp:
+        problem = json.load(fp)
+    start, end, ans = optimize(problem, score.load_solution(fsol), scoring_mode, time_limit, seed)
+    print(f'{pid}: {end} ({end - start:+d})')
+
+    if end <= start and fout == fsol:
+        return
+    write_atomic(fout, json.dumps(ans))
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('input', help='problem file')
+    parser.add_argument('-i', '--pid', metavar='I', type=int, help='problem id')
+    parser.add_argument('-s', '--solution', help='starting solution, default solves/solution-{pid}.json')
+    parser.add_argument('-o', '--output', help='improved solution, default overwrites the starting one')
+    parser.add_argument('-t', '--time-limit', metavar='T', type=int, help='time limit')
+    parser.add_argument('--seed', type=int, help='random seed')
+    args = parser.parse_args()
+    main(
+        input=args.input,
+        pid=args.pid,
+        solution=args.solution,
+        output=args.output,
+        time_limit=args.time_limit,
+        seed=args.seed
+    )
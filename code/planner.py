@@ -1,74 +1,121 @@
 #!/usr/bin/env python
+import heapq
+import os
 import re
 import subprocess
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from bound import problem_bound
 from pathlib import Path
+import profiling
+from poller import Poller
+from score import problem_scoring_mode
+from store import open_store
 
 
-def planner(problems, solutions):
-    while True:
-        tasks = list()
-        for fn in problems.glob('*.json'):
-            pid, = re.findall(r'(\d+)\.json', str(fn))
-            psize = fn.stat().st_size
-            sol = solutions / f'solution-{pid}.json'
-            fscore = solutions / f'solution-{pid}.score.txt'
-            fsubm = solutions / f'solution-{pid}.submission.json'
-            if fsubm.is_file():
-                ts = fsubm.stat().st_mtime
-                tasks.append((0, (ts, psize, pid, fsubm), 1))
-                continue
-            sol_time = 0
-            if sol.is_file():
-                sol_time = sol.stat().st_mtime
-            tasks.append((0, (sol_time, psize, pid, fn), 0))
-        tasks = sorted(tasks)
-        if tasks:
-            yield tasks[0]
-        else:
-            return
+def task_key(order, pid, fn, solutions, last, runs=0):
+    if order != 'gain':
+        return last
+    fscore = solutions / f'solution-{pid}.score.txt'
+    current = float(fscore.read_text()) if fscore.is_file() else 0
+    gain = problem_bound(fn, problem_scoring_mode(fn, int(pid))) - max(current, 0)
+    # repeated attempts at one problem share its headroom
+    return -gain / (1 + runs)
 
 
-def run_solver(mtime, sz, pid, fn, time_limit):
-    solver = Path(__file__).parent / 'solve.py'
-    p = subprocess.run([str(solver), str(fn), '-t', time_limit or '0'], stdout=sys.stdout, stderr=sys.stderr)
-    p.check_returncode()
+def scan_tasks(problems, solutions, store, order='age'):
+    tasks = list()
+    for fn in problems.glob('*.json'):
+        pid, = re.findall(r'(\d+)\.json', str(fn))
+        psize = fn.stat().st_size
+        sol = solutions / f'solution-{pid}.json'
+        sol_time = store.last_attempt(int(pid))
+        if sol_time is None:
+            sol_time = sol.stat().st_mtime if sol.is_file() else 0
+        tasks.append((task_key(order, pid, fn, solutions, sol_time), psize, pid, fn))
+    heapq.heapify(tasks)
+    return tasks
 
 
-def check_submission(mtime, sz, pid, fn):
-    prog = Path(__file__).parent / 'check_submission.py'
-    p = subprocess.run([str(prog), str(fn), '--pid', str(pid)])
-    p.check_returncode()
+def planner(problems, solutions, jobs, timeout, poll_interval=5, profile=None, order='age'):
+    store = open_store(solutions / 'results.db')
+    tasks = scan_tasks(problems, solutions, store, order)
+    runs = dict()
+    poller = Poller(solutions, store=store)
+    poller.scan()
+    poller.start()
+    held = dict()
+    solving = dict()
+    try:
+        with ThreadPoolExecutor(max_workers=jobs) as solvers:
+            while tasks or held or solving:
+                for pid,task in list(held.items()):
+                    if not poller.is_pending(pid):
+                        heapq.heappush(tasks, held.pop(pid))
 
+                while tasks and len(solving) < jobs:
+                    task = heapq.heappop(tasks)
+                    if poller.is_pending(task[2]):
+                        held[task[2]] = task
+                        continue
+                    print('run', task, flush=True)
+                    solving[solvers.submit(run_solver, *task, time_limit=timeout, profile=profile)] = task
 
-def run_task(task, timeout):
-    print('run', task)
-    _,op,id = task
-    match id:
-        case 0:
-            run_solver(*op, time_limit=timeout)
-        case 1:
-            check_submission(*op)
-    
+                done, _ = wait(solving, timeout=poll_interval, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    if (exc := fut.exception()) is not None:
+                        print('!', repr(exc), file=sys.stderr, flush=True)
+                    _,psize,pid,fn = solving.pop(fut)
+                    runs[pid] = runs.get(pid, 0) + 1
+                    heapq.heappush(tasks, (task_key(order, pid, fn, solutions, time.time(), runs[pid]), psize, pid, fn))
+                    for _,sid in store.pending_submissions(int(pid)):
+                        poller.add(pid, sid)
+                if not solving and held and not tasks:
+                    time.sleep(poll_interval)
+    finally:
+        poller.stop()
+        store.close()
+        if profile and Path(profile).is_file():
+            profiling.print_summary(profiling.aggregate(profile))
 
-def main(problems, solutions, timeout):
-    for task in planner(Path(problems), Path(solutions)):
-        run_task(task, timeout)    
+
+def run_solver(mtime, sz, pid, fn, time_limit, profile=None):
+    solver = Path(__file__).parent / 'solve.py'
+    args = [str(solver), str(fn), '-t', time_limit or '0']
+    if profile:
+        args += ['--profile', str(profile)]
+    t = time.perf_counter()
+    p = subprocess.run(args, stdout=sys.stdout, stderr=sys.stderr)
+    if profile:
+        # includes interpreter startup, which solve.py cannot see
+        profiling.append_record(profile, {'pid': pid, 'times': {'process': time.perf_counter() - t}})
+    p.check_returncode()
+
+
+def main(problems, solutions, timeout, jobs, profile, order):
+    planner(Path(problems), Path(solutions), jobs=jobs, timeout=timeout, profile=profile, order=order)
 
 
 if __name__ == '__main__':
     proj = Path(__file__).parent.parent
     taskdir = proj / 'task'
     solvdir = proj / 'solves'
-    
+
     import argparse
     parser = argparse.ArgumentParser()
     parser.add_argument('-d', '--problems-directory', default=taskdir, help='problems directory, default ' + str(taskdir))
     parser.add_argument('-s', '--solutions-directory', default=solvdir, help='solutions directory, default ' + str(solvdir))
     parser.add_argument('-t', '--timeout', help='task timeout')
+    parser.add_argument('-j', '--jobs', metavar='N', type=int, default=os.cpu_count(), help='concurrent solvers, default ' + str(os.cpu_count()))
+    parser.add_argument('-o', '--order', choices=('age','gain'), default='age', help='least recently solved first, or largest bound - score.txt gain first')
+    parser.add_argument('--profile', metavar='FILE', help='collect solver profiles in FILE, summarized on exit')
     args = parser.parse_args()
     main(
         problems=args.problems_directory,
         solutions=args.solutions_directory,
-        timeout=args.timeout
-    )
\ No newline at end of file
+        timeout=args.timeout,
+        jobs=args.jobs,
+        profile=args.profile,
+        order=args.order
+    )
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+import api
+import asyncio
+import json
+import re
+import sys
+import threading
+import time
+from check_submission import record_submission
+from pathlib import Path
+from store import open_store
+
+
+class Poller:
+    # Polls all outstanding submissions over one client. Each submission
+    # backs off from min_interval to max_interval while it stays pending.
+
+    def __init__(self, solutions, min_interval=1, max_interval=60, batch=32, rescan=False, store=None):
+        self.solutions = Path(solutions)
+        self.store = store
+        self.rescan = rescan
+        self.scanned = 0
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.batch = batch
+        self.pending = dict()
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def scan(self):
+        self.scanned = time.monotonic()
+        for fn in self.solutions.glob('solution-*.submission.json'):
+            pid, = re.findall(r'solution-(\d+)\.submission\.json', fn.name)
+            with fn.open() as fp:
+                sid = json.load(fp)['_id']
+            with self.lock:
+                known = sid in self.pending
+            if not known:
+                self.add(pid, sid, delay=0)
+        if self.store is not None:
+            for pid,sid in self.store.pending_submissions():
+                with self.lock:
+                    known = sid in self.pending
+                if not known:
+                    self.add(pid, sid, delay=0)
+
+    def add(self, pid, sid, delay=None):
+        with self.lock:
+            self.pending[sid] = (time.monotonic() + (self.min_interval if delay is None else delay), self.min_interval, str(pid))
+
+    def is_pending(self, pid):
+        with self.lock:
+            return any(p == str(pid) for _,_,p in self.pending.values())
+
+    def next_due(self):
+        with self.lock:
+            return min((t for t,_,_ in self.pending.values()), default=None)
+
+    async def poll(self, cli):
+        now = time.monotonic()
+        with self.lock:
+            due = sorted((t, sid) for sid,(t,_,_) in self.pending.items() if t <= now)
+            due = [sid for _,sid in due[:self.batch]]
+        res = await asyncio.gather(*(cli.get_submission(sid) for sid in due), return_exceptions=True)
+        for sid,ss in zip(due, res):
+            with self.lock:
+                _,interval,pid = self.pending[sid]
+            interval = min(self.max_interval, interval * 2)
+            if isinstance(ss, Exception):
+                print('!', pid, sid, repr(ss), file=sys.stderr, flush=True)
+                with self.lock:
+                    self.pending[sid] = (time.monotonic() + interval, interval, pid)
+                continue
+            print(pid, repr(ss), flush=True)
+            fscore = self.solutions / f'solution-{pid}.score.txt'
+            fsubm = self.solutions / f'solution-{pid}.submission.json'
+            # file writes and the store can be slow, keep the lock for pending only
+            done = record_submission(ss, fscore, fsubm, self.store) is not None
+            with self.lock:
+                if done:
+                    self.pending.pop(sid, None)
+                else:
+                    self.pending[sid] = (time.monotonic() + interval, interval, pid)
+
+    async def run(self, forever=False):
+        async with api.open_async_client(concurrency=self.batch) as cli:
+            while not self.stopping.is_set():
+                if self.rescan and time.monotonic() - self.scanned >= self.max_interval:
+                    self.scan()
+                if (due := self.next_due()) is None:
+                    if not forever:
+                        break
+                    due = time.monotonic() + self.min_interval
+                if (wait := due - time.monotonic()) > 0:
+                    await asyncio.sleep(min(wait, self.min_interval))
+                    continue
+                await self.poll(cli)
+
+    def start(self):
+        self.thread = threading.Thread(target=asyncio.run, args=(self.run(forever=True),), daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+
+def main(solutions, forever):
+    poller = Poller(solutions, rescan=forever, store=open_store(Path(solutions) / 'results.db'))
+    poller.scan()
+    asyncio.run(poller.run(forever=forever))
+
+
+if __name__ == '__main__':
+    proj = Path(__file__).parent.parent
+    solvdir = proj / 'solves'
+
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', '--solutions-directory', default=solvdir, help='solutions directory, default ' + str(solvdir))
+    parser.add_argument('-f', '--forever', action='store_true', help='keep running and pick up new submission files')
+    args = parser.parse_args()
+    main(
+        solutions=args.solutions_directory,
+        forever=args.forever
+    )
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+import json
+import sys
+import io
+import numpy as np
+from array import array
+from atomic import write_atomic
+from pathlib import Path
+
+
+# stored as problem-N.{name}.npy next to problem-N.json
+NAMES = ('stage', 'musicians', 'people', 'tastes', 'pillars')
+
+
+def problem_columns(problem):
+    stage = np.array([problem['room_width'], problem['room_height'], problem['stage_width'], problem['stage_height'],
+        *problem['stage_bottom_left']], dtype=np.float64)
+    musicians = np.array(problem['musicians'], dtype=np.int64)
+    people = np.array([[o['x'], o['y']] for o in problem['attendees']], dtype=np.float64).reshape(-1, 2)
+    tastes = np.array([o['tastes'] for o in problem['attendees']], dtype=np.float64)
+    pillars = np.array([[*o['center'], o['radius']] for o in problem['pillars']], dtype=np.float64).reshape(-1, 3)
+    return dict(zip(NAMES, (stage, musicians, people, tastes, pillars)))
+
+
+class JsonStream:
+    # Decodes one json value at a time from a file, reading as it goes, so
+    # a long array can be consumed element by element.
+
+    WHITESPACE = ' \t\r\n'
+    NUMBER = '0123456789.eE+-'
+
+    def __init__(self, fp, chunk=1 << 16):
+        self.fp = fp
+        self.chunk = chunk
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def fill(self):
+        # doubles the read while a value keeps running past the buffer
+        data = self.fp.read(max(self.chunk, len(self.buf) - self.pos))
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+        self.eof = not data
+        return not self.eof
+
+    def peek(self):
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in self.WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                return ''
+
+    def expect(self, c):
+        if (got := self.peek()) != c:
+            raise ValueError(f'expected {c!r} at offset {self.pos}, got {got!r}')
+        self.pos += 1
+
+    def skip(self, c):
+        if self.peek() == c:
+            self.pos += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                v, end = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if not self.fill():
+                    raise
+                continue
+            # a number cut by the end of the buffer may go on in the next read
+            if (end < len(self.buf) and self.buf[end] not in self.NUMBER) or self.eof:
+                self.pos = end
+                return v
+            self.fill()
+
+
+def stream_columns(fn):
+    # attendees go straight into typed arrays, one small dict at a time
+    xy = array('d')
+    tastes = array('d')
+    fields = dict()
+    with Path(fn).open() as fp:
+        js = JsonStream(fp)
+        js.expect('{')
+        while js.peek() != '}':
+            key = js.value()
+            js.expect(':')
+            if key == 'attendees':
+                js.expect('[')
+                while js.peek() != ']':
+                    o = js.value()
+                    xy.extend((o['x'], o['y']))
+                    tastes.extend(o['tastes'])
+                    js.skip(',')
+                js.expect(']')
+                fields[key] = len(xy) // 2
+            else:
+                fields[key] = js.value()
+            js.skip(',')
+        js.expect('}')
+
+    na = fields['attendees']
+    people = np.frombuffer(xy, dtype=np.float64).reshape(na, 2)
+    tastes = np.frombuffer(tastes, dtype=np.float64).reshape(na, len(tastes) // na if na else 0)
+    stage = np.array([fields['room_width'], fields['room_height'], fields['stage_width'], fields['stage_height'],
+        *fields['stage_bottom_left']], dtype=np.float64)
+    musicians = np.array(fields['musicians'], dtype=np.int64)
+    pillars = np.array([[*o['center'], o['radius']] for o in fields['pillars']], dtype=np.float64).reshape(-1, 3)
+    return dict(zip(NAMES, (stage, musicians, people, tastes, pillars)))
+
+
+def column_files(fn):
+    fn = Path(fn)
+    return {name: fn.with_name(f'{fn.stem}.{name}.npy') for name in NAMES}
+
+
+def is_fresh(fn):
+    mtime = Path(fn).stat().st_mtime
+    return all(f.is_file() and f.stat().st_mtime >= mtime for f in column_files(fn).values())
+
+
+def save_columns(fn):
+    columns = stream_columns(fn)
+    for name,f in column_files(fn).items():
+        buf = io.BytesIO()
+        np.save(buf, columns[name])
+        write_atomic(f, buf.getvalue())
+    return columns
+
+
+def load_columns(fn):
+    # memory mapped, the arrays are rebuilt when the json is newer
+    if not is_fresh(fn):
+        save_columns(fn)
+    return {name: np.load(f, mmap_mode='r') for name,f in column_files(fn).items()}
+
+
+def main(inputs, force):
+    for d in inputs:
+        d = Path(d)
+        files = sorted(d.glob('problem-*.json')) if d.is_dir() else [d]
+        for fn in files:
+            if force or not is_fresh(fn):
+                save_columns(fn)
+                print(fn, file=sys.stderr, flush=True)
+
+
+if __name__ == '__main__':
+    proj = Path(__file__).parent.parent
+    taskdirs = [proj / 'task' / 'lite', proj / 'task' / 'full']
+
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('inputs', nargs='*', help='problem files or directories, default task/lite and task/full')
+    parser.add_argument('-f', '--force', action='store_true', help='rebuild up to date arrays')
+    args = parser.parse_args()
+    main(
+        inputs=args.inputs or taskdirs,
+        force=args.force
+    )
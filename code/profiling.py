@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+import contextlib
+import json
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+
+
+PROFILE = None
+
+
+class Profile:
+    def __init__(self):
+        self.counters = Counter()
+        self.times = Counter()
+
+    def count(self, name, n=1):
+        self.counters[name] += n
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.times[name] += time.perf_counter() - t
+
+    def as_dict(self):
+        return {'counters': dict(self.counters), 'times': dict(self.times)}
+
+
+def enable():
+    global PROFILE
+    PROFILE = Profile()
+    return PROFILE
+
+
+def count(name, n=1):
+    if PROFILE is not None:
+        PROFILE.count(name, n)
+
+
+def phase(name):
+    if PROFILE is None:
+        return contextlib.nullcontext()
+    return PROFILE.phase(name)
+
+
+def write_profile(fn, record):
+    text = json.dumps(record, indent=1)
+    if fn == '-':
+        print(text, file=sys.stderr, flush=True)
+        return
+    Path(fn).write_text(text)
+
+
+def append_record(fn, record):
+    # one short line per write, concurrent solvers can share the file
+    with Path(fn).open('a') as fp:
+        fp.write(json.dumps(record) + '\n')
+
+
+def aggregate(fn):
+    totals = dict()
+    with Path(fn).open() as fp:
+        for line in fp:
+            rec = json.loads(line)
+            t = totals.setdefault(str(rec['pid']), {'runs': 0, 'counters': Counter(), 'times': Counter()})
+            t['runs'] += rec.get('run', 0)
+            t['counters'].update(rec.get('counters', dict()))
+            t['times'].update(rec.get('times', dict()))
+    return totals
+
+
+def print_summary(totals, file=sys.stdout):
+    names = sorted({k for t in totals.values() for k in t['times']})
+    print(f'{"pid":>4} {"runs":>5}', *(f'{k:>9}' for k in names), file=file)
+    for pid,t in sorted(totals.items(), key=lambda kv: int(kv[0]) if kv[0].isdigit() else -1):
+        print(f'{pid:>4} {t["runs"]:>5}', *(f'{t["times"].get(k, 0):>9.3f}' for k in names), file=file)
+
+
+def main(input, output):
+    totals = aggregate(input)
+    if output:
+        write_profile(output, {pid: {'runs': t['runs'], 'counters': dict(t['counters']), 'times': dict(t['times'])}
+            for pid,t in totals.items()})
+    else:
+        print_summary(totals)
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('input', help='profile records written by solve.py --profile')
+    parser.add_argument('-o', '--output', help='write the totals per problem as json, - for stderr')
+    args = parser.parse_args()
+    main(
+        input=args.input,
+        output=args.output
+    )
@@ -1,12 +1,27 @@
 #!/usr/bin/env python
+import functools
 import json
 import math
 import re
 import sys
+import numpy as np
+import profiling
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from occlusion import Occlusion, pillar_index, stage_distance2
+from preprocess import load_columns, problem_columns
 from pathlib import Path
 
 
-def score_placement(placement, volumes, musicians, people, tastes, pillars, scoring_mode):
+def score_placement(placement, volumes, musicians, people, tastes, pillars, scoring_mode, index=None):
+    prof = profiling.PROFILE is not None
+    segment_tests = pillar_tests = early_breaks = 0
+    # index from occlusion.pillar_index, each attendee only tests the pillars it lists
+    if index is None:
+        near = [pillars] * len(people)
+    else:
+        indptr, indices = index
+        near = [[pillars[zp] for zp in indices[a:b].tolist()] for a,b in zip(indptr.tolist(), indptr[1:].tolist())]
     ans = 0
     for j,(k,p) in enumerate(zip(musicians, placement)):
         sub = 0
@@ -22,17 +37,26 @@ def score_placement(placement, volumes, musicians, people, tastes, pillars, scor
                 tt = f.real * f.real + f.imag * f.imag
                 # if tt / d2 < 25 and abs(tz) < abs(d):
                 if (tt < 25*d2) and (tz.real*tz.real+tz.imag*tz.imag) < d2:
+                    if prof:
+                        segment_tests += z if z > j else z + 1
+                        early_breaks += 1
                     break
             else:
-                for pz,zr in pillars:
+                if prof:
+                    segment_tests += len(placement) - 1
+                for zp,(pz,zr) in enumerate(near[i]):
                     tz = q - pz
-                    t = abs(d.real * tz.imag - tz.real * d.imag) 
                     f = d.real * tz.imag - tz.real * d.imag
                     tt = f.real * f.real + f.imag * f.imag
                     # if t * t / d2 < zr * zr and abs(tz) < abs(d):
                     if (tt < zr*zr*d2) and (tz.real*tz.real+tz.imag*tz.imag) < d2:
+                        if prof:
+                            pillar_tests += zp + 1
+                            early_breaks += 1
                         break
                 else:
+                    if prof:
+                        pillar_tests += len(near[i])
                     t = tastes[i][k]
                     sub += math.ceil(1000000 * t / d2)
         if scoring_mode == 2:
@@ -44,28 +68,348 @@ def score_placement(placement, volumes, musicians, people, tastes, pillars, scor
             ans += math.ceil(sub * qm * volumes[j])
         else:
             ans += sub * volumes[j]
+    if prof:
+        profiling.count('segment_tests', segment_tests)
+        profiling.count('pillar_tests', pillar_tests)
+        profiling.count('early_breaks', early_breaks)
     return ans
 
 
-def main(problem, solution, scoring_mode, pid):
-    if scoring_mode is None:
-        if pid is None:
-            if (ns := re.findall(r'(\d+)\.json', str(problem))):
-                pid, = map(int, ns)
-        scoring_mode = 2 if (pid or 0) > 55 else 1
-        
-    with Path(problem).open() as fp:
-        problem = json.load(fp)
-    with Path(solution).open() as fp:
-        solution = json.load(fp)
+def closeness_np(placement, musicians):
+    dx = placement[:,None,0] - placement[None,:,0]
+    dy = placement[:,None,1] - placement[None,:,1]
+    same = musicians[:,None] == musicians[None,:]
+    np.fill_diagonal(same, False)
+    terms = np.zeros(same.shape)
+    np.divide(1, np.hypot(dx, dy), out=terms, where=same)
+    # sequential sum, same rounding as the reference loop
+    qm = np.hstack([np.ones((len(placement), 1)), terms])
+    return np.cumsum(qm, axis=1)[:,-1]
+
+
+def instrument_groups(musicians):
+    # musician indices per instrument, each in index order
+    order = np.argsort(musicians, kind='stable')
+    ks, starts = np.unique(musicians[order], return_index=True)
+    return list(zip(ks.tolist(), np.split(order, starts[1:])))
+
+
+def sum_musicians_np(vis, placement, musicians, people, tastes, scoring_mode):
+    dx = placement[:,0] - people[:,0,None]
+    dy = placement[:,1] - people[:,1,None]
+    d2 = dx * dx + dy * dy
+    groups = instrument_groups(musicians)
+    qm = np.ones(len(placement))
+    if 2 * len(groups) > len(placement):
+        with profiling.phase('impact'):
+            impact = np.ceil(1000000 * tastes[:,musicians] / d2)
+            sub = np.where(vis, impact, 0).astype(np.int64).sum(axis=0)
+        if scoring_mode == 2:
+            with profiling.phase('closeness'):
+                qm = closeness_np(placement, musicians)
+        return sub, qm
+
+    # few instruments, weight each taste once and score an instrument's columns together
+    weight = 1000000 * tastes
+    sub = np.zeros(len(placement), dtype=np.int64)
+    for k,g in groups:
+        with profiling.phase('impact'):
+            impact = np.ceil(weight[:,k,None] / d2[:,g])
+            sub[g] = np.where(vis[:,g], impact, 0).astype(np.int64).sum(axis=0)
+        if scoring_mode == 2:
+            with profiling.phase('closeness'):
+                qm[g] = closeness_np(placement[g], musicians[g])
+    return sub, qm
+
+
+def score_musicians_np(placement, musicians, people, tastes, pillars, scoring_mode, occlusion=None):
+    if occlusion is None:
+        occlusion = Occlusion(people, pillars)
+    with profiling.phase('occlusion'):
+        vis = occlusion.visibility(placement)
+    return sum_musicians_np(vis, placement, musicians, people, tastes, scoring_mode)
+
+
+class SharedArrays:
+    # numpy arrays in shared memory blocks, attached by name in workers
+    def __init__(self, **arrays):
+        self.blocks = list()
+        self.spec = dict()
+        for name,a in arrays.items():
+            a = np.ascontiguousarray(a)
+            shm = shared_memory.SharedMemory(create=True, size=max(1, a.nbytes))
+            np.ndarray(a.shape, dtype=a.dtype, buffer=shm.buf)[...] = a
+            self.blocks.append(shm)
+            self.spec[name] = (shm.name, a.shape, a.dtype.str)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        for shm in self.blocks:
+            shm.close()
+            shm.unlink()
+        self.blocks = list()
+
+
+def attach_arrays(spec):
+    blocks = dict()
+    arrays = dict()
+    for name,(shm_name, shape, dtype) in spec.items():
+        blocks[name] = shared_memory.SharedMemory(name=shm_name)
+        arrays[name] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=blocks[name].buf)
+    return blocks, arrays
+
+
+def _score_shard(spec, a0, a1):
+    blocks, ar = attach_arrays(spec)
+    people = occ = None
+    try:
+        people = ar['people'][a0:a1]
+        occ = Occlusion(people, ar['pillars'], ar['stage'].tolist())
+        vis = occ.visibility(ar['placement'])
+        sub, _ = sum_musicians_np(vis, ar['placement'], ar['musicians'], people, ar['tastes'][a0:a1], 1)
+        return sub
+    finally:
+        # views into the blocks must go before they close
+        ar = people = occ = None
+        for shm in blocks.values():
+            shm.close()
+
+
+def score_musicians_parallel(placement, musicians, people, tastes, pillars, stage, scoring_mode, jobs):
+    # shards attendees across processes, per-musician sums are exact integers
+    cuts = np.linspace(0, len(people), jobs + 1).astype(int)
+    with profiling.phase('shards'), SharedArrays(placement=placement, musicians=musicians, people=people, tastes=tastes, pillars=pillars,
+            stage=stage) as sa:
+        with ProcessPoolExecutor(max_workers=jobs) as ex:
+            futs = [ex.submit(_score_shard, sa.spec, a0, a1) for a0,a1 in zip(cuts, cuts[1:]) if a1 > a0]
+            sub = np.zeros(len(placement), dtype=np.int64)
+            for f in futs:
+                sub += f.result()
+    if scoring_mode == 2:
+        qm = closeness_np(placement, musicians)
+    else:
+        qm = np.ones(len(placement))
+    return sub, qm
+
+
+def total_score(sub, qm, volumes, scoring_mode):
+    if scoring_mode == 2:
+        return sum(math.ceil(s * q * v) for s,q,v in zip(sub.tolist(), qm.tolist(), volumes))
+    return sum(s * v for s,v in zip(sub.tolist(), volumes))
+
+
+def best_volumes(sub):
+    # values are linear in the volume, so the sign of the sum decides
+    return np.where(np.asarray(sub) > 0, 10, 0).tolist()
+
+
+def score_placement_np(placement, volumes, musicians, people, tastes, pillars, scoring_mode, occlusion=None):
+    sub, qm = score_musicians_np(placement, musicians, people, tastes, pillars, scoring_mode, occlusion)
+    return total_score(sub, qm, volumes, scoring_mode)
+
+
+def stratify(people, tastes, stage, strata):
+    # strata of equal size by distance to the stage, and a proxy for the
+    # spread of each attendee's contribution, which falls off as 1/d2
+    d2 = np.maximum(stage_distance2(people, stage), 1)
+    edges = np.quantile(d2, np.linspace(0, 1, strata + 1)[1:-1])
+    proxy = np.abs(tastes).max(axis=1, initial=0) / d2
+    return np.searchsorted(edges, d2, side='right'), proxy
+
+
+def sample_attendees(strata, proxy, fraction, seed=None):
+    # Neyman allocation with the proxy standing in for each stratum's spread
+    rng = np.random.default_rng(seed)
+    hs = np.unique(strata)
+    size = np.array([np.count_nonzero(strata == h) for h in hs])
+    spread = np.array([proxy[strata == h].sum() for h in hs]) + 1e-12
+    budget = max(2 * len(hs), math.ceil(fraction * len(strata)))
+    n = np.zeros(len(hs), dtype=int)
+    full = np.zeros(len(hs), dtype=bool)
+    for _ in range(len(hs)):
+        left = budget - size[full].sum()
+        n = np.where(full, size, np.ceil(left * spread / spread[~full].sum()).astype(int))
+        over = ~full & (n >= size)
+        if not over.any():
+            break
+        full |= over
+    n = np.clip(n, 2, size)
+    rows = [np.sort(rng.choice(np.flatnonzero(strata == h), k, replace=False)) for h,k in zip(hs, n)]
+    return np.concatenate(rows)
+
+
+def score_approx_np(placement, volumes, musicians, people, tastes, pillars, scoring_mode, strata, rows,
+        occlusion=None, z=1.96):
+    # stratified estimate of the total from the attendees in rows, and the
+    # half width of its confidence interval. Mode 2 rounding is ignored.
+    if occlusion is None:
+        occlusion = Occlusion(people[rows], pillars)
+    with profiling.phase('occlusion'):
+        vis = occlusion.visibility(placement)
+    dx = placement[:,0] - people[rows,0,None]
+    dy = placement[:,1] - people[rows,1,None]
+    impact = np.ceil(1000000 * tastes[rows][:,musicians] / (dx * dx + dy * dy))
+    weight = np.asarray(volumes, dtype=np.float64)
+    if scoring_mode == 2:
+        weight = weight * closeness_np(placement, musicians)
+    contrib = (np.where(vis, impact, 0) * weight).sum(axis=1)
+
+    est = var = 0
+    sampled = strata[rows]
+    for h in np.unique(strata):
+        nh = int(np.count_nonzero(strata == h))
+        c = contrib[sampled == h]
+        est += nh * c.mean()
+        if len(c) > 1:
+            var += nh * nh * (1 - len(c) / nh) * c.var(ddof=1) / len(c)
+    return est, z * math.sqrt(var)
+
+
+def score_reference(problem, solution, scoring_mode, cull=False):
+    # cull only tests the pillars from occlusion.pillar_index, which is exact
+    # for musicians on the stage region but not for invalid placements
     musicians = problem['musicians']
     people = [o['x'] + 1j * o['y'] for o in problem['attendees']]
     tastes = [o['tastes'] for o in problem['attendees']]
     pos = [o['x'] + 1j * o['y'] for o in solution['placements']]
     volumes = solution.get('volumes') or [1] * len(pos)
     pillars = [[o['center'][0] + 1j * o['center'][1], o['radius']] for o in problem['pillars']]
-    ans = score_placement(pos, volumes, musicians, people, tastes, pillars, scoring_mode)
-    print(ans)
+    index = None
+    if cull:
+        columns = problem_columns(problem)
+        index = pillar_index(columns['people'], columns['pillars'], columns['stage'].tolist())
+    return score_placement(pos, volumes, musicians, people, tastes, pillars, scoring_mode, index)
+
+
+def solution_arrays(solution):
+    pos = np.array([[o['x'], o['y']] for o in solution['placements']], dtype=np.float64).reshape(-1, 2)
+    volumes = solution.get('volumes') or [1] * len(pos)
+    return pos, volumes
+
+
+def problem_scoring_mode(problem, pid=None):
+    if pid is None:
+        if (ns := re.findall(r'(\d+)\.json', str(problem))):
+            pid, = map(int, ns)
+    return 2 if (pid or 0) > 55 else 1
+
+
+class Problem:
+    def __init__(self, problem, scoring_mode, columns=None):
+        self.problem = problem
+        self.scoring_mode = scoring_mode
+        columns = columns or problem_columns(problem)
+        self.stage = columns['stage']
+        self.musicians, self.people, self.tastes, self.pillars = (columns[k] for k in ('musicians', 'people', 'tastes', 'pillars'))
+        self.occlusion = Occlusion(self.people, self.pillars, self.stage.tolist())
+        self.samples = dict()
+
+    def score_musicians(self, placement, jobs=None):
+        if jobs and jobs > 1:
+            return score_musicians_parallel(placement, self.musicians, self.people, self.tastes, self.pillars,
+                self.stage, self.scoring_mode, jobs)
+        return score_musicians_np(placement, self.musicians, self.people, self.tastes, self.pillars,
+            self.scoring_mode, self.occlusion)
+
+    def score(self, solution, jobs=None):
+        pos, volumes = solution_arrays(solution)
+        sub, qm = self.score_musicians(pos, jobs)
+        return total_score(sub, qm, volumes, self.scoring_mode)
+
+    def score_approx(self, solution, fraction=0.1, strata=8, seed=0):
+        # the sample and its occlusion are kept, so repeated calls rank solutions alike
+        key = (fraction, strata, seed)
+        if key not in self.samples:
+            ids, proxy = stratify(self.people, self.tastes, self.stage.tolist(), strata)
+            rows = sample_attendees(ids, proxy, fraction, seed)
+            self.samples[key] = ids, rows, Occlusion(self.people[rows], self.pillars, self.stage.tolist())
+        ids, rows, occ = self.samples[key]
+        pos, volumes = solution_arrays(solution)
+        return score_approx_np(pos, volumes, self.musicians, self.people, self.tastes, self.pillars,
+            self.scoring_mode, ids, rows, occ)
+
+    def scorer(self, solution):
+        from scorer import Scorer
+        pos, volumes = solution_arrays(solution)
+        return Scorer(self.musicians, self.people, self.tastes, self.pillars, self.scoring_mode,
+            pos, volumes, self.occlusion)
+
+
+@functools.lru_cache(maxsize=8)
+def _load_problem(fn, scoring_mode):
+    with profiling.phase('load'):
+        return Problem(None, scoring_mode, load_columns(fn))
+
+
+def load_problem(fn, scoring_mode=None, pid=None):
+    if scoring_mode is None:
+        scoring_mode = problem_scoring_mode(fn, pid)
+    return _load_problem(str(Path(fn).resolve()), scoring_mode)
+
+
+def load_solution(fn):
+    with Path(fn).open() as fp:
+        return json.load(fp)
+
+
+def score_file(problem, solution, scoring_mode=None, pid=None, jobs=None):
+    if not isinstance(solution, dict):
+        solution = load_solution(solution)
+    return load_problem(problem, scoring_mode, pid).score(solution, jobs)
+
+
+class ScorePool:
+    # worker processes keep their loaded problems between tasks
+    def __init__(self, jobs=None):
+        self.jobs = jobs
+        self.backend = None
+
+    def __enter__(self):
+        self.backend = ProcessPoolExecutor(max_workers=self.jobs)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        if (ex := self.backend) is not None:
+            self.backend = None
+            ex.shutdown()
+
+    def submit(self, problem, solution, scoring_mode=None, pid=None):
+        return self.backend.submit(score_file, str(problem), solution, scoring_mode, pid)
+
+
+def main(problem, solution, scoring_mode, pid, engine, jobs, profile, approx, strata, verify):
+    if scoring_mode is None:
+        scoring_mode = problem_scoring_mode(problem, pid)
+    if profile:
+        profiling.enable()
+
+    if approx:
+        # search guidance only, --verify also scores exactly
+        est, hw = load_problem(problem, scoring_mode).score_approx(load_solution(solution), approx, strata)
+        ans = int(est)
+        print(f'{ans} +- {math.ceil(hw)}')
+        if verify:
+            ans = score_file(problem, solution, scoring_mode, jobs=jobs)
+            print(ans, 'within' if abs(ans - est) <= hw else 'outside', 'the interval')
+    else:
+        if engine == 'np':
+            ans = score_file(problem, solution, scoring_mode, jobs=jobs)
+        else:
+            with profiling.phase('load'):
+                with Path(problem).open() as fp:
+                    problem = json.load(fp)
+                solution = load_solution(solution)
+            with profiling.phase('reference'):
+                ans = score_reference(problem, solution, scoring_mode, engine == 'py-cull')
+        print(ans)
+
+    if profile:
+        profiling.write_profile(profile, {'engine': engine, 'score': ans, **profiling.PROFILE.as_dict()})
 
 
 if __name__ == '__main__':
@@ -75,10 +419,23 @@ if __name__ == '__main__':
     parser.add_argument('solution', help='solution file')
     parser.add_argument('-m', '--scoring-mode', metavar='M', choices=(1,2), type=int, help='scoring mode, 1 lite, 2 full')
     parser.add_argument('-i', '--pid', metavar='I', type=int, help='problem id')
+    parser.add_argument('-e', '--engine', choices=('np','py','py-cull'), default='np',
+        help='scoring engine, np vectorized, py reference, py-cull reference testing nearby pillars only, default np')
+    parser.add_argument('-j', '--jobs', metavar='N', type=int, help='score attendee shards on N processes, np engine only')
+    parser.add_argument('--profile', metavar='FILE', nargs='?', const='-', help='write counters and phase times as json, default stderr')
+    parser.add_argument('-a', '--approx', metavar='F', type=float, help='estimate from a fraction F of attendees, with a 95%% interval')
+    parser.add_argument('--strata', metavar='N', type=int, default=8, help='distance strata for --approx, default 8')
+    parser.add_argument('--verify', action='store_true', help='with --approx, also score exactly')
     args = parser.parse_args()
     main(
         problem=args.problem,
         solution=args.solution,
         scoring_mode=args.scoring_mode,
-        pid=args.pid
+        pid=args.pid,
+        engine=args.engine,
+        jobs=args.jobs,
+        profile=args.profile,
+        approx=args.approx,
+        strata=args.strata,
+        verify=args.verify
     )
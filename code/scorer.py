@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+import math
+import numpy as np
+from occlusion import Occlusion
+from score import closeness_np
+
+
+class Scorer:
+    # Keeps per (attendee, musician) blocker counts and impacts, so that a
+    # move only recomputes the moved column and the pairs the musician blocked
+    # before or blocks after, in O(A*M). Scores match score.score_placement.
+
+    def __init__(self, musicians, people, tastes, pillars, scoring_mode, placement, volumes=None, occlusion=None):
+        self.musicians = np.asarray(musicians, dtype=np.int64)
+        self.people = np.asarray(people, dtype=np.float64).reshape(-1, 2)
+        self.tastes = np.asarray(tastes, dtype=np.float64)
+        self.scoring_mode = scoring_mode
+        self.occlusion = occlusion or Occlusion(self.people, pillars)
+        self.placement = np.array(placement, dtype=np.float64).reshape(-1, 2)
+        nm = len(self.placement)
+        self.volumes = list(volumes) if volumes is not None else [1] * nm
+        self.counts = self.occlusion.counts(self.placement)
+        self.impact = self._impact(self.placement, self.musicians)
+        self.sub = np.where(self.counts == 0, self.impact, 0).sum(axis=0)
+        self.qm = np.ones(nm)
+        if scoring_mode == 2:
+            for g in self._groups(self.musicians, set(self.musicians.tolist())):
+                self.qm[g] = closeness_np(self.placement[g], self.musicians[g])
+        self.values = [self._value(j) for j in range(nm)]
+        self.score = sum(self.values)
+        self._proposal = None
+
+    def _impact(self, pos, instruments):
+        dx = pos[:,0] - self.people[:,0,None]
+        dy = pos[:,1] - self.people[:,1,None]
+        d2 = dx * dx + dy * dy
+        return np.ceil(1000000 * self.tastes[:,instruments] / d2).astype(np.int64)
+
+    def _groups(self, musicians, instruments):
+        return [np.flatnonzero(musicians == k) for k in sorted(instruments)]
+
+    def _value(self, j, sub=None, qm=None, volume=None):
+        s = int(self.sub[j] if sub is None else sub)
+        q = float(self.qm[j] if qm is None else qm)
+        v = self.volumes[j] if volume is None else volume
+        if self.scoring_mode == 2:
+            return math.ceil(s * q * v)
+        return s * v
+
+    def _closeness(self, placement, instruments):
+        qm = dict()
+        if self.scoring_mode == 2:
+            for g in self._groups(self.musicians, instruments):
+                qm.update(zip(g.tolist(), closeness_np(placement[g], self.musicians[g]).tolist()))
+        return qm
+
+    def _finish(self, kind, key, counts, impact, sub, qm, placement, volumes):
+        changed = set(sub) | set(qm) | set(volumes)
+        values = dict()
+        for j in changed:
+            values[j] = self._value(j, sub.get(j), qm.get(j), volumes.get(j))
+        delta = sum(values.values()) - sum(self.values[j] for j in changed)
+        self._proposal = (kind, key, delta, counts, impact, sub, qm, placement, volumes, values)
+        return delta
+
+    def _propose_move(self, j, pos):
+        pos = np.asarray(pos, dtype=np.float64)
+        key = (j, tuple(pos.tolist()))
+        if self._proposal and self._proposal[:2] == ('move', key):
+            return self._proposal[2]
+        occ = self.occlusion
+        hits_old, hits_new = occ.blocker_hits(self.placement, j, self.placement[j], pos)
+        cols = np.flatnonzero((hits_old != hits_new).any(axis=0))
+        block = self.counts[:,cols] - hits_old[:,cols] + hits_new[:,cols]
+        subs = np.where(block == 0, self.impact[:,cols], 0).sum(axis=0)
+        col = occ.target_counts(self.placement, j, pos)
+        impact = self._impact(pos[None,:], self.musicians[j:j+1])[:,0]
+        counts = (np.append(cols, j), np.hstack([block, col[:,None]]))
+        sub = dict(zip(cols.tolist(), subs.tolist()))
+        sub[j] = int(np.where(col == 0, impact, 0).sum())
+        placement = self.placement.copy()
+        placement[j] = pos
+        qm = self._closeness(placement, {int(self.musicians[j])})
+        return self._finish('move', key, counts, {j: impact}, sub, qm, placement, dict())
+
+    def _propose_swap(self, j, m):
+        key = (j, m)
+        if self._proposal and self._proposal[:2] == ('swap', key):
+            return self._proposal[2]
+        counts = ([j, m], self.counts[:,[m,j]])
+        placement = self.placement.copy()
+        placement[[j,m]] = self.placement[[m,j]]
+        cols = self._impact(placement[[j,m]], self.musicians[[j,m]])
+        impact = {j: cols[:,0], m: cols[:,1]}
+        sub = {z: int(np.where(c == 0, impact[z], 0).sum()) for z,c in zip((j, m), counts[1].T)}
+        qm = self._closeness(placement, {int(self.musicians[j]), int(self.musicians[m])})
+        return self._finish('swap', key, counts, impact, sub, qm, placement, dict())
+
+    def _propose_volume(self, j, volume):
+        key = (j, volume)
+        if self._proposal and self._proposal[:2] == ('volume', key):
+            return self._proposal[2]
+        return self._finish('volume', key, None, dict(), dict(), dict(), None, {j: volume})
+
+    def _apply(self):
+        kind, key, delta, counts, impact, sub, qm, placement, volumes, values = self._proposal
+        self._proposal = None
+        if counts is not None:
+            cols, block = counts
+            self.counts[:,cols] = block
+        if placement is not None:
+            self.placement = placement
+        for z,col in impact.items():
+            self.impact[:,z] = col
+        for z,s in sub.items():
+            self.sub[z] = s
+        for z,q in qm.items():
+            self.qm[z] = q
+        for z,v in volumes.items():
+            self.volumes[z] = v
+        for z,v in values.items():
+            self.values[z] = v
+        self.score += delta
+        return self.score
+
+    def delta_move(self, j, pos):
+        return self._propose_move(j, pos)
+
+    def move(self, j, pos):
+        self._propose_move(j, pos)
+        return self._apply()
+
+    def delta_swap(self, j, m):
+        return self._propose_swap(j, m)
+
+    def swap(self, j, m):
+        self._propose_swap(j, m)
+        return self._apply()
+
+    def delta_volume(self, j, volume):
+        return self._propose_volume(j, volume)
+
+    def set_volume(self, j, volume):
+        self._propose_volume(j, volume)
+        return self._apply()
+
+    def solution(self):
+        return {
+            'placements': [{'x':x, 'y':y} for x,y in self.placement.tolist()],
+            'volumes': list(self.volumes),
+        }
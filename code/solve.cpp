@@ -6,6 +6,9 @@
 #include <cstdlib>
 #include <cstring>
 #include <random>
+#include <fcntl.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
 #include <unistd.h>
 
 
@@ -47,6 +50,10 @@ typedef struct __attribute__((packed)) {
 } pack_pillar;
 
 
+// optional warm start block: magic, n, n positions, n, n volumes
+static const u32 WARM_MAGIC = 0x4d524157; // "WARM"
+
+
 static inline u8
 timed_out(const steady_clock::time_point& time_start, u32 time_limit) {
     if (time_limit != 0) {
@@ -117,7 +124,7 @@ score_placement(u32 pos_index, u32 instrument, const pack_pos* ans, const pack_h
 
 static i64
 solve(const pack_header& conf, const u32* musicians, const pack_ipos* people,
-    const i32* tastes, const pack_pillar* pillars, pack_pos* ans, u32* ans_vol) {
+    const i32* tastes, const pack_pillar* pillars, const pack_pos* warm, pack_pos* ans, u32* ans_vol) {
     auto ts_start = steady_clock::now();
     const r32 R = 10, R2 = 20;
     const r32 R34h = 15;
@@ -214,6 +221,11 @@ solve(const pack_header& conf, const u32* musicians, const pack_ipos* people,
         }
     }
 #endif
+
+    if (warm) {
+        // continue from the previous best placement instead of the grid
+        memcpy(ans, warm, conf.musicians * sizeof(pack_pos));
+    }
     
     i64 score = 0;
     for (u32 j = 0; j < conf.musicians; ++j) {
@@ -271,32 +283,75 @@ readin(void* buf, size_t size) {
 }
 
 
+static u8*
+map_file(const char* fn, size_t* size) {
+    int fd = open(fn, O_RDONLY);
+    if (fd == -1) {
+        perror(fn);
+        exit(1);
+    }
+    struct stat st;
+    if (fstat(fd, &st) == -1) {
+        perror(fn);
+        exit(1);
+    }
+    *size = st.st_size;
+    if (st.st_size == 0) {
+        close(fd);
+        return nullptr;
+    }
+    void* mem = mmap(nullptr, st.st_size, PROT_READ, MAP_PRIVATE, fd, 0);
+    close(fd);
+    if (mem == MAP_FAILED) {
+        perror(fn);
+        exit(1);
+    }
+    return (u8*) mem;
+}
+
+
+static const pack_pos*
+read_warm(const u8* data, size_t size, u32 musicians) {
+    if (!data || size < 2 * sizeof(u32)) {
+        return nullptr;
+    }
+    u32 magic = *(const u32*) &data[0];
+    u32 n = *(const u32*) &data[sizeof(u32)];
+    if (magic != WARM_MAGIC || n != musicians || size < 2 * sizeof(u32) + n * sizeof(pack_pos)) {
+        fprintf(stderr, "! ignoring warm start\n");
+        return nullptr;
+    }
+    return (const pack_pos*) &data[2 * sizeof(u32)];
+}
+
+
 int
 main(int argc, char* argv[]) {
     u8* msg_pack = nullptr;
+    size_t msg_size = 0;
     
     if (argc > 1) {
-        FILE* fp = fopen(argv[1], "rb");
-        if (!fp) {
-            perror(argv[1]);
+        msg_pack = map_file(argv[1], &msg_size);
+    }
+
+    int fout = STDOUT_FILENO;
+    if (argc > 2) {
+        fout = open(argv[2], O_WRONLY | O_CREAT | O_TRUNC, 0644);
+        if (fout == -1) {
+            perror(argv[2]);
             return 1;
         }
-        fseek(fp, 0, SEEK_END);
-        size_t sz = ftell(fp);
-        fseek(fp, 0, SEEK_SET);
-        msg_pack = (u8*) malloc(sz);
-        fread(msg_pack, 1, sz, fp);
-        fclose(fp);
     }
 
     if (!msg_pack) {
-        u32 msg_size = 0;
-        u32 res = readin(&msg_size, sizeof(msg_size));
+        u32 size = 0;
+        u32 res = readin(&size, sizeof(size));
         if (i32(res) <= 0) {
             puts("! missing input");
             return 1;
         }
 
+        msg_size = size;
         msg_pack = (u8*) malloc(msg_size);
         readin(msg_pack, msg_size);
     }
@@ -317,17 +372,27 @@ main(int argc, char* argv[]) {
     pack_pillar* pillars = (pack_pillar*) &msg_pack[off];
     off += conf.pillars * sizeof(pack_pillar);
 
+    // warm start from a trailing block of the message, or from argv[3]
+    const pack_pos* warm = nullptr;
+    if (off < msg_size) {
+        warm = read_warm(&msg_pack[off], msg_size - off, conf.musicians);
+    }
+    if (argc > 3) {
+        size_t warm_size = 0;
+        u8* warm_pack = map_file(argv[3], &warm_size);
+        warm = read_warm(warm_pack, warm_size, conf.musicians);
+    }
     
     pack_pos* ans = (pack_pos*) malloc(conf.musicians * sizeof(pack_pos));
     u32* vol = (u32*) malloc(conf.musicians * sizeof(u32));
     
-    i64 score = solve(conf, musicians, ppl, tastes, pillars, &ans[0], &vol[0]);
+    i64 score = solve(conf, musicians, ppl, tastes, pillars, warm, &ans[0], &vol[0]);
 
-    write(STDOUT_FILENO, &score, sizeof(score));
-    write(STDOUT_FILENO, &conf.musicians, sizeof(conf.musicians));
-    write(STDOUT_FILENO, &ans[0], conf.musicians * sizeof(pack_pos));
-    write(STDOUT_FILENO, &conf.musicians, sizeof(conf.musicians));
-    write(STDOUT_FILENO, &vol[0], conf.musicians * sizeof(u32));
+    write(fout, &score, sizeof(score));
+    write(fout, &conf.musicians, sizeof(conf.musicians));
+    write(fout, &ans[0], conf.musicians * sizeof(pack_pos));
+    write(fout, &conf.musicians, sizeof(conf.musicians));
+    write(fout, &vol[0], conf.musicians * sizeof(u32));
     
     return 0;
 }
@@ -1,107 +1,87 @@
 #!/usr/bin/env python
+import api
+import check_submission
+import hashlib
 import io
 import json
 import math
+import mmap
+import numpy as np
+import profiling
 import re
-import requests
+import score
 import struct
 import subprocess
 import sys
 import tempfile
 import time
-import tomllib
+import validate
+from atomic import write_atomic
 from pathlib import Path
-from urllib.parse import urljoin
+from preprocess import load_columns, problem_columns
+from store import open_store
 
 
-class Client:
-    API_URL = 'https://api.icfpcontest.com'
-    
-    def __init__(self, headers):
-        self.api_url = self.API_URL
-        self.headers = headers
-        self.backend = None
-        self.timeout = (0.3, 10)
-
-    def __enter__(self):
-        self.backend = requests.Session()
-        return self
-
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        self.close()
-
-    def close(self):
-        if (ses := self.backend) is not None:
-            self.backend = None
-            ses.close()
-
-    def get_json(self, path, tries=10):
-        url = urljoin(self.api_url, path)
-        delay = 5
-        for _ in range(tries):
-            r = self.backend.get(url, headers=self.headers, timeout=self.timeout)
-            if not r.ok:
-                time.sleep(delay)
-                delay *= 1.8
-            else:
-                break
-        r.raise_for_status()
-        return r.json()
-    
-    def post_json(self, path, body, tries=10):
-        url = urljoin(self.api_url, path)
-        delay = 5
-        for _ in range(tries):
-            r = self.backend.post(url, json=body, headers=self.headers, timeout=self.timeout)
-            if not r.ok:
-                time.sleep(delay)
-                delay *= 1.8
-            else:
-                break
-        r.raise_for_status()
-        return r.json()
+def api_pack_problem(problem, scoring_mode, time_limit):
+    return api_pack_columns(problem_columns(problem), scoring_mode, time_limit)
+
+
+def api_pack_columns(columns, scoring_mode, time_limit):
+    def pack(v): return np.asarray(v, dtype=np.float64).astype(np.int32).tobytes()
+
+    mps = columns['musicians']
+    ks = len(np.unique(mps))
+
+    data = pack([
+        *columns['stage'],
+        ks, len(mps),
+        len(columns['people']),
+        len(columns['pillars']),
+        scoring_mode or 0,
+        time_limit or 0,
+    ])
+    data += pack(mps)
+    data += pack(columns['people'])
+    data += pack(columns['tastes'])
+    data += pack(columns['pillars'])
+    return data
 
-    def get_submission(self, sid):
-        r = self.get_json(f'/submission?submission_id={sid}')
-        return r['Success']['submission']
-    
-    def post_submission(self, pid, ans):
-        body = {'problem_id':pid, 'contents': json.dumps(ans)}
-        r = self.post_json('/submission', body)
-        return r
 
+def packed_problem_file(fn, scoring_mode, time_limit, cache=None):
+    if cache is None:
+        cache = Path(__file__).parent.parent / 'cache'
+    fn = Path(fn)
+    key = hashlib.sha256(fn.read_bytes()).hexdigest()[:16]
+    fcache = cache / f'{fn.stem}-{key}-m{scoring_mode or 0}-t{time_limit or 0}.bin'
+    if fcache.is_file():
+        return fcache
+    data = api_pack_columns(load_columns(fn), scoring_mode, time_limit)
+    write_atomic(fcache, data)
+    return fcache
+
+
+WARM_MAGIC = 0x4d524157
+
+
+def api_pack_warm(solution):
+    # optional solver input, laid out like the answer after a magic word
+    pos = np.array([[o['x'], o['y']] for o in solution['placements']], dtype=np.float32)
+    vol = np.asarray(solution.get('volumes') or [1] * len(pos), dtype=np.uint32)
+    return struct.pack('II', WARM_MAGIC, len(pos)) + pos.tobytes() + struct.pack('I', len(vol)) + vol.tobytes()
+
+
+def warm_start(input, fsol):
+    # the solver holds f32 positions, a solution valid only in f64 is left out
+    if not fsol.is_file():
+        return None
+    with fsol.open() as fp:
+        solution = json.load(fp)
+    pos = np.array([[o['x'], o['y']] for o in solution['placements']], dtype=np.float32).astype(np.float64)
+    rounded = {**solution, 'placements': [{'x':x, 'y':y} for x,y in pos.tolist()]}
+    if validate.violations(load_columns(input), rounded):
+        return None
+    return api_pack_warm(solution)
 
-def api_pack_problem(problem, scoring_mode, time_limit):
-    def packi(x): return struct.pack('i', int(x))
-    def mpacki(v): return b''.join(map(packi, v))
-    def mpack2i(v): return b''.join(map(mpacki, v))
-    def packf(x): return struct.pack('f', float(x))
-    def mpackf(v): return b''.join(map(packf, v))
-    def mpack2f(v): return b''.join(map(mpackf, v))
-    
-    rw = problem['room_width']
-    rh = problem['room_height']
-    sw = problem['stage_width']
-    sh = problem['stage_height']
-    ox,oy = problem['stage_bottom_left']
-    mps = problem['musicians']
-    ppl = problem['attendees']
-    bps = problem['pillars']
-    ks = len(set(mps))
-    
-    data = packi(rw) + packi(rh)
-    data += packi(sw) + packi(sh)
-    data += packi(ox) + packi(oy)
-    data += packi(ks) + packi(len(mps))
-    data += packi(len(ppl))
-    data += packi(len(bps))
-    data += packi(scoring_mode or 0)
-    data += packi(time_limit or 0)
-    data += mpacki(mps)
-    data += mpack2i([[o['x'],o['y']] for o in ppl])
-    data += mpack2i([o['tastes'] for o in ppl])
-    data += mpack2i([*o['center'], o['radius']] for o in bps)
-    return data
 
 def api_unpack_answer(data):
     def unpackl(data):
@@ -125,31 +105,17 @@ def api_unpack_answer(data):
 
 
 def score_solution(problem, solution):
-    codes = Path(__file__).parent
-    app = codes / 'score.py'
-    p = subprocess.run([str(app), str(problem), str(solution)], stdout=subprocess.PIPE, encoding='utf-8')
-    p.check_returncode()
-    ans = int(p.stdout)
-    return ans
+    return score.score_file(problem, solution)
 
 
-def open_client():
-    proj = Path(__file__).parent.parent
-    env = proj / '.env'
-    headers = None
-    if env.is_file():
-        with env.open('rb') as fp:
-            config = tomllib.load(fp)
-            headers = config.get('headers', dict())
-    return Client(headers=headers)
+def tune_volumes(problem, scoring_mode, ans):
+    pos, _ = score.solution_arrays(ans)
+    sub, qm = score.load_problem(problem, scoring_mode).score_musicians(pos)
+    volumes = score.best_volumes(sub)
+    return score.total_score(sub, qm, volumes, scoring_mode), {**ans, 'volumes': volumes}
 
 
-def main(input, pid, solver, time_limit, no_submit):
-    if pid is None:
-        pid, = map(int, re.findall(r'(\d+)\.json', input))
-    with Path(input).open() as fp:
-        problem = json.load(fp)
-
+def solve(input, pid, solver, time_limit, no_submit, cold=False):
     scoring_mode = 2 if pid > 55 else 1
         
     proj = Path(__file__).parent.parent
@@ -158,56 +124,85 @@ def main(input, pid, solver, time_limit, no_submit):
     fscore = proj / 'solves' / f'solution-{pid}.score.txt'
     fsubm = proj / 'solves' / f'solution-{pid}.submission.json'
     old_score = float(fscore.read_text()) if fscore.is_file() else float('-inf')
+    started = time.time()
     
-    msg = api_pack_problem(problem, scoring_mode, time_limit)
-
-    if len(msg) < 10000:
-        imsg = struct.pack('I', len(msg)) + msg
-        p = subprocess.run([solver], input=imsg, stdout=subprocess.PIPE, stderr=sys.stderr)
-    else:
-        with tempfile.NamedTemporaryFile('wb') as fmsg:
-            fmsg.write(msg)
-            fmsg.flush()
-            p = subprocess.run([solver, fmsg.name], stdout=subprocess.PIPE, stderr=sys.stderr)
-    p.check_returncode()
-    score, ans = api_unpack_answer(p.stdout)
+    with profiling.phase('pack'):
+        fmsg = packed_problem_file(input, scoring_mode, time_limit)
+        warm = None if cold else warm_start(input, fsol)
+
+    # the solver maps the cached message and writes its answer to fans,
+    # fwarm carries the best placement so far
+    with tempfile.NamedTemporaryFile('w+b', dir=fmsg.parent, suffix='.ans') as fans, \
+            tempfile.NamedTemporaryFile('wb', dir=fmsg.parent, suffix='.warm') as fwarm:
+        args = [solver, str(fmsg), fans.name]
+        if warm:
+            fwarm.write(warm)
+            fwarm.flush()
+            args.append(fwarm.name)
+        t = time.perf_counter()
+        with profiling.phase('solver'):
+            p = subprocess.run(args, stdout=subprocess.PIPE, stderr=sys.stderr)
+        solver_time = time.perf_counter() - t
+        p.check_returncode()
+        with profiling.phase('unpack'):
+            if Path(fans.name).stat().st_size > 0:
+                with mmap.mmap(fans.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    score, ans = api_unpack_answer(data)
+            else:
+                score, ans = api_unpack_answer(p.stdout)
+    with profiling.phase('volumes'):
+        score, ans = tune_volumes(input, scoring_mode, ans)
     
     diff = score - old_score
     sdiff = f'{int(diff):+d}' if math.isfinite(diff) else diff
     print(f'{pid}: {score} ({sdiff})')
 
-    if score < 0 or diff < 1000000:
-        if fsol.is_file():
-            fsol.touch()
-        return
-    
-    with fsol.open('w') as fp:
-        json.dump(ans, fp)
+    # the server would only fail it after a round trip
+    invalid = validate.violations(load_columns(input), ans)
+    for err in invalid[:10]:
+        print('!', pid, err, file=sys.stderr, flush=True)
+    keep = not invalid and score >= 0 and diff >= 1000000
+    with open_store(proj / 'solves' / 'results.db') as store:
+        attempt = store.record_attempt(pid, started, score, solver_time, ans if keep else None)
+        if not keep:
+            if fsol.is_file():
+                fsol.touch()
+            return
 
-    viz = proj / 'code' / 'viz.py'
-    subprocess.run([viz, str(input), str(fsol), '-o', str(fimg)])
+        write_atomic(fsol, json.dumps(ans))
 
-    if no_submit:
-        return
-        
-    with open_client() as cli:
-        sid  = cli.post_submission(pid, ans)
-        time.sleep(1)
-        ss = cli.get_submission(sid)
-        print(repr(ss))
-        
-    score = ss.get('score', dict())
-    if isinstance(score, dict):
-        if (sn := score.get('Success')) is None:
-            if score.get('Failure'):
-                sn = -1
-        if sn is not None:
-            with fscore.open('w') as fp:
-                print(sn, end='', file=fp)
-            fsubm.unlink(missing_ok=True)
+        # not waited for, viz.py -b renders whatever is missing later
+        viz = proj / 'code' / 'viz.py'
+        subprocess.Popen([viz, str(input), str(fsol), '-o', str(fimg)], stdin=subprocess.DEVNULL)
+
+        if no_submit:
             return
-    with fsubm.open('w') as fp:
-        json.dump(ss, fp)
+
+        with api.open_client() as cli:
+            with profiling.phase('network'):
+                sid  = cli.post_submission(pid, ans)
+            store.record_submission(pid, sid, attempt)
+            time.sleep(1)
+            with profiling.phase('network'):
+                ss = cli.get_submission(sid)
+            print(repr(ss))
+
+        check_submission.record_submission(ss, fscore, fsubm, store)
+
+
+def main(input, pid, solver, time_limit, no_submit, profile, cold):
+    if pid is None:
+        pid, = map(int, re.findall(r'(\d+)\.json', input))
+    if not profile:
+        solve(input, pid, solver, time_limit, no_submit, cold)
+        return
+
+    prof = profiling.enable()
+    try:
+        with prof.phase('total'):
+            solve(input, pid, solver, time_limit, no_submit, cold)
+    finally:
+        profiling.append_record(profile, {'pid': pid, 'run': 1, **prof.as_dict()})
 
 
 if __name__ == '__main__':
@@ -218,11 +213,15 @@ if __name__ == '__main__':
     parser.add_argument('-a', '--action', metavar='A', default='./solve', help='solver executable')
     parser.add_argument('-i', '--pid', metavar='I', type=int, help='problem id')
     parser.add_argument('-n', '--no-submit', action='store_true', help='suppress submission')
+    parser.add_argument('--profile', metavar='FILE', help='append phase times and scoring counters to FILE')
+    parser.add_argument('--cold', action='store_true', help='do not start the solver from the saved solution')
     args = parser.parse_args()
     main(
         input=args.input,
         pid=args.pid,
         solver=args.action,
         time_limit=args.time_limit,
-        no_submit=args.no_submit
+        no_submit=args.no_submit,
+        profile=args.profile,
+        cold=args.cold
     )
\ No newline at end of file
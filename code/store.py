@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS problems (
+    pid INTEGER PRIMARY KEY,
+    last_attempt REAL,
+    best_local INTEGER,
+    best_server INTEGER
+);
+CREATE INDEX IF NOT EXISTS problems_last_attempt ON problems(last_attempt);
+CREATE INDEX IF NOT EXISTS problems_gap ON problems(best_local - coalesce(best_server, 0));
+
+CREATE TABLE IF NOT EXISTS attempts (
+    id INTEGER PRIMARY KEY,
+    pid INTEGER NOT NULL,
+    started REAL NOT NULL,
+    finished REAL NOT NULL,
+    local_score INTEGER,
+    solver_time REAL,
+    solution TEXT
+);
+CREATE INDEX IF NOT EXISTS attempts_pid ON attempts(pid, local_score);
+
+CREATE TABLE IF NOT EXISTS submissions (
+    sid TEXT PRIMARY KEY,
+    pid INTEGER NOT NULL,
+    attempt INTEGER REFERENCES attempts(id),
+    submitted REAL NOT NULL,
+    server_score INTEGER,
+    updated REAL
+);
+CREATE INDEX IF NOT EXISTS submissions_pending ON submissions(pid) WHERE server_score IS NULL;
+'''
+
+
+class Store:
+    # Results of every solve and submission, one sqlite file shared by the
+    # planner and its solvers. Connections are per thread.
+
+    def __init__(self, fn):
+        self.fn = Path(fn)
+        self.local = threading.local()
+        self.fn.parent.mkdir(parents=True, exist_ok=True)
+        self.db.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @property
+    def db(self):
+        if (db := getattr(self.local, 'db', None)) is None:
+            db = sqlite3.connect(self.fn, timeout=30, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self.local.db = db
+        return db
+
+    def close(self):
+        if (db := getattr(self.local, 'db', None)) is not None:
+            self.local.db = None
+            db.close()
+
+    def transaction(self):
+        return Transaction(self.db)
+
+    def record_attempt(self, pid, started, local_score, solver_time=None, solution=None, finished=None):
+        # only attempts that keep a solution can raise best_local
+        finished = finished or time.time()
+        with self.transaction() as db:
+            cur = db.execute('INSERT INTO attempts (pid, started, finished, local_score, solver_time, solution) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (pid, started, finished, local_score, solver_time, json.dumps(solution) if solution else None))
+            db.execute('INSERT INTO problems (pid, last_attempt, best_local) VALUES (?, ?, ?) '
+                'ON CONFLICT(pid) DO UPDATE SET last_attempt = excluded.last_attempt, '
+                'best_local = max(coalesce(best_local, excluded.best_local), coalesce(excluded.best_local, best_local))',
+                (pid, finished, local_score if solution else None))
+            return cur.lastrowid
+
+    def record_submission(self, pid, sid, attempt=None, submitted=None):
+        with self.transaction() as db:
+            db.execute('INSERT OR IGNORE INTO submissions (sid, pid, attempt, submitted) VALUES (?, ?, ?, ?)',
+                (sid, pid, attempt, submitted or time.time()))
+
+    def update_submission(self, sid, server_score):
+        with self.transaction() as db:
+            db.execute('UPDATE submissions SET server_score = ?, updated = ? WHERE sid = ?',
+                (server_score, time.time(), sid))
+            db.execute('UPDATE problems SET best_server = max(coalesce(best_server, ?), ?) '
+                'WHERE pid = (SELECT pid FROM submissions WHERE sid = ?)', (server_score, server_score, sid))
+
+    def last_attempts(self):
+        return self.db.execute('SELECT pid, last_attempt FROM problems ORDER BY last_attempt').fetchall()
+
+    def last_attempt(self, pid):
+        row = self.db.execute('SELECT last_attempt FROM problems WHERE pid = ?', (pid,)).fetchone()
+        return row[0] if row else None
+
+    def gaps(self):
+        # unsubmitted gains first
+        return self.db.execute('SELECT pid, best_local - coalesce(best_server, 0) AS gap FROM problems '
+            'ORDER BY gap DESC').fetchall()
+
+    def best(self, pid):
+        row = self.db.execute('SELECT best_local, best_server FROM problems WHERE pid = ?', (pid,)).fetchone()
+        return row or (None, None)
+
+    def pending_submissions(self, pid=None):
+        if pid is None:
+            return self.db.execute('SELECT pid, sid FROM submissions WHERE server_score IS NULL').fetchall()
+        return self.db.execute('SELECT pid, sid FROM submissions WHERE server_score IS NULL AND pid = ?',
+            (pid,)).fetchall()
+
+
+class Transaction:
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        self.db.execute('BEGIN IMMEDIATE')
+        return self.db
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.db.execute('ROLLBACK' if exc_type else 'COMMIT')
+
+
+def open_store(fn=None):
+    proj = Path(__file__).parent.parent
+    return Store(fn or proj / 'solves' / 'results.db')
+
+
+def main(store, pid, order):
+    with open_store(store) as st:
+        if pid is not None:
+            print(pid, *st.best(pid), st.last_attempt(pid))
+            for row in st.db.execute('SELECT id, started, finished, local_score, solver_time FROM attempts '
+                    'WHERE pid = ? ORDER BY finished', (pid,)):
+                print(*row)
+            return
+        rows = st.gaps() if order == 'gap' else st.last_attempts()
+        for row in rows:
+            print(*row)
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', '--pid', metavar='I', type=int, help='show the attempts for a problem')
+    parser.add_argument('-o', '--order', choices=('last','gap'), default='last', help='problem order, by last attempt or by unsubmitted gain')
+    parser.add_argument('--store', help='store file, default solves/results.db')
+    args = parser.parse_args()
+    main(
+        store=args.store,
+        pid=args.pid,
+        order=args.order
+    )
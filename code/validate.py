@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+import json
+import sys
+import numpy as np
+from pathlib import Path
+from preprocess import load_columns
+
+
+MARGIN = 10
+SPACING = 10
+MAX_VOLUME = 10
+# cells to the right and above, so every neighbouring pair is visited once
+NEIGHBOURS = ((0, 0), (1, -1), (1, 0), (1, 1), (0, 1))
+
+
+def stage_region(stage):
+    # where musicians may stand
+    _,_,sw,sh,ox,oy = stage
+    return ox + MARGIN, oy + MARGIN, ox + sw - MARGIN, oy + sh - MARGIN
+
+
+def out_of_bounds(placement, stage):
+    x0,y0,x1,y1 = stage_region(stage)
+    x, y = placement[:,0], placement[:,1]
+    bad = (x < x0) | (x > x1) | (y < y0) | (y > y1)
+    return np.flatnonzero(bad)
+
+
+def close_pairs(placement, spacing=SPACING):
+    # grid of spacing sized cells, only pairs in neighbouring cells can be close
+    n = len(placement)
+    if n < 2:
+        return np.zeros((0, 2), dtype=np.int64)
+    cell = np.floor(placement / spacing).astype(np.int64)
+    cell -= cell.min(axis=0)
+    width = int(cell[:,1].max()) + 3
+    key = (cell[:,0] + 1) * width + cell[:,1] + 1
+    order = np.argsort(key, kind='stable')
+    skey = key[order]
+    pairs = list()
+    for dx,dy in NEIGHBOURS:
+        want = key + dx * width + dy
+        lo = np.searchsorted(skey, want, side='left')
+        hi = np.searchsorted(skey, want, side='right')
+        cnt = hi - lo
+        total = int(cnt.sum())
+        if total == 0:
+            continue
+        a = np.repeat(np.arange(n), cnt)
+        b = order[np.repeat(lo - np.cumsum(cnt) + cnt, cnt) + np.arange(total)]
+        if (dx, dy) == (0, 0):
+            keep = a < b
+            a, b = a[keep], b[keep]
+        d = placement[a] - placement[b]
+        close = (d * d).sum(axis=1) < spacing * spacing
+        pairs.append(np.stack([a[close], b[close]], axis=1))
+    pairs = np.vstack(pairs) if pairs else np.zeros((0, 2), dtype=np.int64)
+    return np.sort(pairs, axis=1)
+
+
+def bad_volumes(volumes):
+    v = np.asarray(volumes, dtype=np.float64)
+    return np.flatnonzero((v < 0) | (v > MAX_VOLUME))
+
+
+def violations(columns, solution):
+    placement = np.array([[o['x'], o['y']] for o in solution['placements']], dtype=np.float64).reshape(-1, 2)
+    res = list()
+    if len(placement) != len(columns['musicians']):
+        res.append(f'{len(placement)} placements for {len(columns["musicians"])} musicians')
+    for j in out_of_bounds(placement, columns['stage'].tolist()).tolist():
+        res.append(f'musician {j} at {tuple(placement[j].tolist())} is off stage')
+    for j,m in close_pairs(placement).tolist():
+        res.append(f'musicians {j} and {m} are closer than {SPACING}')
+    if (volumes := solution.get('volumes')) is not None:
+        if len(volumes) != len(placement):
+            res.append(f'{len(volumes)} volumes for {len(placement)} placements')
+        for j in bad_volumes(volumes).tolist():
+            res.append(f'musician {j} has volume {volumes[j]}')
+    return res
+
+
+def main(problem, solution):
+    with Path(solution).open() as fp:
+        solution = json.load(fp)
+    res = violations(load_columns(problem), solution)
+    for s in res:
+        print(s)
+    if res:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('problem', help='problem file')
+    parser.add_argument('solution', help='solution file')
+    args = parser.parse_args()
+    main(
+        problem=args.problem,
+        solution=args.solution
+    )
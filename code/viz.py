@@ -1,62 +1,155 @@
 #!/usr/bin/env python
 import json
+import math
+import re
 import sys
+import numpy as np
+from occlusion import Occlusion
 from pathlib import Path
-from PIL import Image, ImageDraw
+from PIL import Image
+from preprocess import load_columns
 
 
-def main(problem, solution, output):
-    with Path(problem).open() as fp:
-        problem = json.load(fp)
+PALETTE = [255,255,255, 211,210,208, 151,148,154, 241,154,154, 123,152,255, 173,10,10]
+HEAT_LEVELS = 8
+HEAT = len(PALETTE) // 3
+# heat entries, blue for negative attendees and red for positive, weakest first
+for i in range(1, HEAT_LEVELS + 1):
+    c = 255 - 200 * i // HEAT_LEVELS
+    PALETTE += [c, c, 255]
+for i in range(1, HEAT_LEVELS + 1):
+    c = 255 - 200 * i // HEAT_LEVELS
+    PALETTE += [255, c, c]
+
+
+def disk(r):
+    n = math.ceil(r)
+    y,x = np.mgrid[-n:n+1, -n:n+1]
+    m = x * x + y * y <= max(r, 0.5) ** 2
+    return x[m], y[m]
+
+
+def splat(canvas, xs, ys, r, color):
+    # stamps a disk of radius r at every point, color may be one per point
+    h,w = canvas.shape
+    ox,oy = disk(r)
+    px = (np.rint(xs).astype(int)[:,None] + ox).ravel()
+    py = (np.rint(ys).astype(int)[:,None] + oy).ravel()
+    color = np.repeat(np.broadcast_to(color, len(xs)), len(ox))
+    ok = (0 <= px) & (px < w) & (0 <= py) & (py < h)
+    canvas[h - 1 - py[ok], px[ok]] = color[ok]
+
+
+def attendee_scores(columns, placement, volumes):
+    # unscaled by mode 2 closeness, good enough to shade the room
+    occ = Occlusion(columns['people'], columns['pillars'], columns['stage'].tolist())
+    vis = occ.visibility(placement)
+    people = columns['people']
+    dx = placement[:,0] - people[:,0,None]
+    dy = placement[:,1] - people[:,1,None]
+    impact = np.ceil(1000000 * columns['tastes'][:,columns['musicians']] / (dx * dx + dy * dy))
+    return (np.where(vis, impact, 0) * np.asarray(volumes)).sum(axis=1)
+
+
+def heat_colors(values):
+    # a few near attendees dwarf the rest, so the top decile saturates
+    top = np.quantile(np.abs(values), 0.9) if len(values) else 0
+    top = top or 1
+    level = np.ceil(np.abs(values) / top * HEAT_LEVELS).clip(1, HEAT_LEVELS).astype(int) - 1
+    return np.where(values < 0, HEAT + level, HEAT + HEAT_LEVELS + level)
+
+
+def render(columns, solution, scale=1, heat=False):
+    rw,rh,sw,sh,ox,oy = columns['stage'].tolist()
+    w = max(1, math.ceil(rw * scale))
+    h = max(1, math.ceil(rh * scale))
+    canvas = np.zeros((h, w), dtype=np.uint8)
+    x0,x1 = int(ox * scale), math.ceil((ox + sw) * scale)
+    y0,y1 = int(oy * scale), math.ceil((oy + sh) * scale)
+    canvas[max(0, h - y1):h - y0, x0:x1] = 3
+    for x,y,r in columns['pillars'].tolist():
+        splat(canvas, np.array([x * scale]), np.array([y * scale]), r * scale, 2)
+
+    people = columns['people']
+    color = 4
+    if solution and heat:
+        pos = np.array([[o['x'], o['y']] for o in solution['placements']], dtype=np.float64).reshape(-1, 2)
+        volumes = solution.get('volumes') or [1] * len(pos)
+        color = heat_colors(attendee_scores(columns, pos, volumes))
+    splat(canvas, people[:,0] * scale, people[:,1] * scale, max(1, 3 * scale), color)
     if solution:
-        if not Path(solution).is_file():
-            print('! not found', solution, file=sys.stderr)
-            solution = None
-        else:
-            with Path(solution).open() as fp:
-                solution = json.load(fp)
-            
-    rw = problem['room_width']
-    rh = problem['room_height']
-    sw = problem['stage_width']
-    sh = problem['stage_height']
-    ox,oy = problem['stage_bottom_left']
-    mps = problem['musicians']
-    ppl = problem['attendees']
-    bps = problem['pillars']
-    
-    rw,rh,sw,sh,ox,oy = map(int, (rw,rh,sw,sh,ox,oy))
-    
-    im = Image.new('P', (rw, rh))
-    im.putpalette([255,255,255, 211,210,208, 151,148,154, 241,154,154, 123,152,255, 173,10,10])
-    draw = ImageDraw.Draw(im)
-    draw.rectangle([ox, oy, ox+sw-1, oy+sh-1], fill=3)
-    for p in bps:
-        x,y,r = map(int, [p['center'][0], p['center'][1], p['radius']])
-        draw.ellipse([x-r,y-r,x+r-1,y+r-1], fill=2)
-    for p in ppl:
-        x,y = map(int, [p['x'], p['y']])
-        draw.ellipse([x-3,y-3,x+2,y+2], fill=4)
+        pos = np.array([[o['x'], o['y']] for o in solution['placements']], dtype=np.float64).reshape(-1, 2)
+        splat(canvas, pos[:,0] * scale, pos[:,1] * scale, 10 * scale, 5)
+
+    framed = np.ones((h + 2, w + 2), dtype=np.uint8)
+    framed[1:-1,1:-1] = canvas
+    im = Image.new('P', (w + 2, h + 2))
+    im.frombytes(framed.tobytes())
+    im.putpalette(PALETTE)
+    return im
+
+
+def load_solution(fn):
+    if not Path(fn).is_file():
+        print('! not found', fn, file=sys.stderr)
+        return None
+    with Path(fn).open() as fp:
+        return json.load(fp)
+
+
+def render_batch(problems, solutions, scale, heat, force):
+    # renders solution-N.png beside every solution that is newer than its image
+    tasks = {int(n): fn for d in problems for fn in Path(d).glob('problem-*.json')
+        for n in re.findall(r'problem-(\d+)\.json', fn.name)}
+    for fsol in sorted(Path(solutions).glob('solution-*.json')):
+        if not (ns := re.findall(r'^solution-(\d+)\.json$', fsol.name)):
+            continue
+        pid = int(ns[0])
+        fimg = fsol.with_suffix('.png')
+        if pid not in tasks:
+            continue
+        if not force and fimg.is_file() and fimg.stat().st_mtime >= fsol.stat().st_mtime:
+            continue
+        render(load_columns(tasks[pid]), load_solution(fsol), scale, heat).save(fimg)
+        print(fimg, file=sys.stderr, flush=True)
+
+
+def main(problem, solution, output, scale, heat, batch, problems, solutions, force):
+    if batch:
+        render_batch(problems, solutions, scale or 0.25, heat, force)
+        return
     if solution:
-        for p in solution['placements']:
-            x,y = map(int, [p['x'], p['y']])
-            draw.ellipse([x-10,y-10,x+9,y+9], fill=5)
-    im = im.transpose(Image.Transpose.FLIP_TOP_BOTTOM)
-    so = Image.new('P', (rw+2, rh+2), color=1)
-    so.putpalette(im.getpalette())
-    so.paste(im, (1,1))
-    so.save(output)
+        solution = load_solution(solution)
+    render(load_columns(problem), solution, scale or 1, heat).save(output)
 
 
 if __name__ == '__main__':
+    proj = Path(__file__).parent.parent
+    taskdirs = [proj / 'task' / 'lite', proj / 'task' / 'full']
+    solvdir = proj / 'solves'
+
     import argparse
     parser = argparse.ArgumentParser()
-    parser.add_argument('problem', help='problem file')
+    parser.add_argument('problem', nargs='?', help='problem file')
     parser.add_argument('solution', nargs='?', help='solution file')
     parser.add_argument('-o', '--output', help='output file')
+    parser.add_argument('-s', '--scale', type=float, help='image pixels per room unit, default 1, 0.25 in batch mode')
+    parser.add_argument('--heat', action='store_true', help='shade attendees by their score')
+    parser.add_argument('-b', '--batch', action='store_true', help='render every solution in the solutions directory')
+    parser.add_argument('-d', '--problems-directory', action='append', help='batch problems directory, default task/lite and task/full')
+    parser.add_argument('--solutions-directory', default=solvdir, help='batch solutions directory, default ' + str(solvdir))
+    parser.add_argument('-f', '--force', action='store_true', help='batch rerenders up to date images')
     args = parser.parse_args()
+    if not args.batch and not (args.problem and args.output):
+        parser.error('problem and -o are required outside batch mode')
     main(
         problem=args.problem,
         solution=args.solution,
-        output=args.output
+        output=args.output,
+        scale=args.scale,
+        heat=args.heat,
+        batch=args.batch,
+        problems=args.problems_directory or taskdirs,
+        solutions=args.solutions_directory,
+        force=args.force
     )